@@ -16,10 +16,2176 @@ from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import re
 import readline
+import socket
+import threading
+import asyncio
+import shlex
+import tarfile
+import hashlib
+import argparse
+from array import array
+from collections import deque
+
+
+def read_text(path: str, default: Optional[str] = None) -> Optional[str]:
+    """Чтение файла sysfs/procfs без исключений"""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def write_text(path: str, value: str) -> None:
+    """Запись значения в файл sysfs/cgroup или drop-in"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def read_sysfs_value(path: str) -> Optional[str]:
+    """Текущее значение атрибута sysfs ('always [madvise] never' -> 'madvise')"""
+    text = read_text(path)
+    if text is None:
+        return None
+    match = re.search(r'\[([^\]]+)\]', text)
+    return match.group(1) if match else text
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Разбор списка CPU вида '0-3,8,10-11'"""
+    cpus = set()
+    for part in (text or '').strip().split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """Сборка компактного списка CPU ('0-3,8')"""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+class RootedTree:
+    """База для модулей, читающих системные файлы от корня ('/' или фейковое дерево в тестах)"""
+
+    def __init__(self, root: str = '/'):
+        self.root = root
+
+    def path(self, relative: str) -> str:
+        """Путь относительно корня"""
+        return os.path.join(self.root, relative)
+
+
+class CpuTopology(RootedTree):
+    """Топология CPU: домены кэша и типы ядер (P/E) из sysfs"""
+
+    def __init__(self, root: str = '/'):
+        super().__init__(root)
+        self.cpu_dir = self.path('sys/devices/system/cpu')
+        self.cpus = self.detect_cpus()
+
+    def detect_cpus(self) -> List[int]:
+        """Список онлайн-процессоров"""
+        online = read_text(os.path.join(self.cpu_dir, 'online'))
+        if online:
+            return parse_cpu_list(online)
+        cpus = []
+        if os.path.isdir(self.cpu_dir):
+            for name in os.listdir(self.cpu_dir):
+                if re.fullmatch(r'cpu\d+', name):
+                    cpus.append(int(name[3:]))
+        return sorted(cpus)
+
+    def llc_domains(self) -> List[Dict]:
+        """Группы CPU, разделяющие кэш последнего уровня"""
+        domains = {}
+        for cpu in self.cpus:
+            cache_dir = os.path.join(self.cpu_dir, f'cpu{cpu}', 'cache')
+            best = None
+            if os.path.isdir(cache_dir):
+                for index in sorted(os.listdir(cache_dir)):
+                    if not index.startswith('index'):
+                        continue
+                    base = os.path.join(cache_dir, index)
+                    if read_text(os.path.join(base, 'type')) == 'Instruction':
+                        continue
+                    level = int(read_text(os.path.join(base, 'level'), '0') or 0)
+                    shared = read_text(os.path.join(base, 'shared_cpu_list'))
+                    if not shared:
+                        continue
+                    if best is None or level > best[0]:
+                        size = read_text(os.path.join(base, 'size'), '0K')
+                        best = (level, shared, size)
+            if best is None:
+                # Без сведений о кэше CPU не образует домен: иначе каждый стал бы "L0-доменом"
+                continue
+            key = tuple(parse_cpu_list(best[1]))
+            domains.setdefault(key, {'level': best[0], 'size_kb': self.parse_size(best[2]),
+                                     'cpus': list(key)})
+        return sorted(domains.values(), key=lambda d: d['cpus'][0])
+
+    @staticmethod
+    def parse_size(text: str) -> int:
+        """Размер кэша в КБ из строки вида '32768K'"""
+        match = re.match(r'(\d+)\s*([KMG]?)', text or '')
+        if not match:
+            return 0
+        return int(match.group(1)) * {'': 1, 'K': 1, 'M': 1024, 'G': 1024 * 1024}[match.group(2)]
+
+    def core_types(self) -> Dict[str, List[int]]:
+        """Типы ядер гибридных CPU (cpu_core / cpu_atom)"""
+        types = {}
+        devices = self.path('sys/devices')
+        for kind, name in (('performance', 'cpu_core'), ('efficiency', 'cpu_atom')):
+            cpus = read_text(os.path.join(devices, name, 'cpus'))
+            if cpus:
+                types[kind] = [c for c in parse_cpu_list(cpus) if c in self.cpus]
+        return types
+
+    def siblings(self, cpu: int) -> List[int]:
+        """SMT-соседи ядра"""
+        topo = os.path.join(self.cpu_dir, f'cpu{cpu}', 'topology')
+        text = read_text(os.path.join(topo, 'core_cpus_list')) or read_text(os.path.join(topo, 'thread_siblings_list'))
+        return parse_cpu_list(text) if text else [cpu]
+
+    def propose_split(self) -> Dict:
+        """Предложение разбиения на игровые и фоновые ядра"""
+        proposal = {'game': list(self.cpus), 'background': [], 'reason': 'Разбиение не требуется'}
+        if len(self.cpus) < 4:
+            proposal['reason'] = 'Слишком мало ядер для разбиения'
+            return proposal
+
+        types = self.core_types()
+        if types.get('performance') and types.get('efficiency'):
+            proposal['game'] = types['performance']
+            proposal['background'] = [c for c in self.cpus if c not in types['performance']]
+            proposal['reason'] = 'Гибридный CPU: P-ядра для игры, E-ядра для фона'
+            return proposal
+
+        domains = self.llc_domains()
+        if len(domains) > 1:
+            # Игре отдаем домен с самым большим кэшем (X3D), при равенстве - первый
+            game = max(domains, key=lambda d: (d['size_kb'], len(d['cpus']), -d['cpus'][0]))
+            proposal['game'] = game['cpus']
+            proposal['background'] = [c for c in self.cpus if c not in game['cpus']]
+            proposal['reason'] = f"Несколько доменов L{game['level']}: игра на одном CCD/кластере"
+            return proposal
+
+        # Один домен кэша: выделяем первое физическое ядро под фон
+        background = self.siblings(self.cpus[0])
+        proposal['game'] = [c for c in self.cpus if c not in background]
+        proposal['background'] = background
+        proposal['reason'] = 'Общий кэш: одно физическое ядро отдается фоновым задачам'
+        return proposal
+
+
+class CpusetPartitioner(RootedTree):
+    """Применение разбиения CPU через cpuset cgroup v2"""
+
+    GAME_GROUP = 'wextweaks-game'
+    # Только службы: user.slice (рабочий стол, Steam, игры) не ограничиваем
+    BACKGROUND_GROUPS = ['system.slice', 'init.scope']
+
+    def __init__(self, root: str = '/', writer=write_text, mkdir=None, rmdir=os.rmdir, runner=None):
+        super().__init__(root)
+        self.cgroup_root = self.path('sys/fs/cgroup')
+        self.write = writer
+        self.mkdir = mkdir or (lambda path: os.makedirs(path, exist_ok=True))
+        self.rmdir = rmdir
+        self.run = runner or self.run_command
+
+    @staticmethod
+    def run_command(argv: List[str]) -> None:
+        """Запуск systemctl; ненулевой код возврата превращается в OSError"""
+        result = subprocess.run(argv, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(f"{' '.join(argv)}: {result.stderr.strip()}")
+
+    def set_allowed_cpus(self, unit: str, value: str) -> None:
+        """AllowedCPUs= юнита systemd до перезагрузки; пустое значение снимает ограничение"""
+        # Прямая запись в cpuset.cpus слайса перетирается, когда systemd заново применяет юниты
+        self.run(['systemctl', 'set-property', '--runtime', unit, f"AllowedCPUs={value}"])
+
+    def available(self) -> bool:
+        """Проверка наличия cgroup v2 с контроллером cpuset"""
+        controllers = read_text(os.path.join(self.cgroup_root, 'cgroup.controllers'), '')
+        return 'cpuset' in controllers.split()
+
+    def apply(self, game: List[int], background: List[int]) -> Dict[str, str]:
+        """Применение cpuset; возвращает прежние значения для отката"""
+        previous = {}
+        subtree = os.path.join(self.cgroup_root, 'cgroup.subtree_control')
+        if 'cpuset' not in read_text(subtree, '').split():
+            self.write(subtree, '+cpuset')
+
+        game_dir = os.path.join(self.cgroup_root, self.GAME_GROUP)
+        self.mkdir(game_dir)
+        self.write(os.path.join(game_dir, 'cpuset.cpus'), format_cpu_list(game))
+
+        if background:
+            for group in self.BACKGROUND_GROUPS:
+                if not os.path.isdir(os.path.join(self.cgroup_root, group)):
+                    continue
+                previous[group] = read_text(os.path.join(self.cgroup_root, group, 'cpuset.cpus'), '')
+                self.set_allowed_cpus(group, format_cpu_list(background))
+        return previous
+
+    def move_pid(self, pid: int) -> None:
+        """Перенос процесса в игровую группу"""
+        self.write(os.path.join(self.cgroup_root, self.GAME_GROUP, 'cgroup.procs'), str(pid))
+
+    def restore(self, group: str, value: str) -> None:
+        """Возврат AllowedCPUs= юнита к сохраненному значению (пустое - без ограничения)"""
+        if os.path.isdir(os.path.join(self.cgroup_root, group)):
+            self.set_allowed_cpus(group, value)
+
+    def revert(self, previous: Dict[str, str]) -> None:
+        """Откат cpuset к сохраненным значениям"""
+        for group, value in previous.items():
+            self.restore(group, value)
+
+        game_dir = os.path.join(self.cgroup_root, self.GAME_GROUP)
+        if os.path.isdir(game_dir):
+            procs = read_text(os.path.join(game_dir, 'cgroup.procs'), '')
+            for pid in procs.split():
+                self.write(os.path.join(self.cgroup_root, 'cgroup.procs'), pid)
+            self.rmdir(game_dir)
+
+
+class MemoryTuner(RootedTree):
+    """Настройка подсистемы памяти: zram/zswap, THP, MGLRU и swappiness"""
+
+    SYSCTL_DROPIN = 'etc/sysctl.d/99-wextweaks-memory.conf'
+    TMPFILES_DROPIN = 'etc/tmpfiles.d/wextweaks-memory.conf'
+    ZRAM_DROPIN = 'etc/systemd/zram-generator.conf.d/wextweaks.conf'
+
+    # swappiness под бэкенд: сжатый своп в RAM дешевле сброса page cache
+    SWAPPINESS = {'zram': 180, 'zswap': 100, 'none': 10}
+
+    def total_ram_mb(self) -> int:
+        """Объем RAM в МБ"""
+        meminfo = read_text(self.path('proc/meminfo'), '')
+        match = re.search(r'MemTotal:\s*(\d+)', meminfo)
+        return int(match.group(1)) // 1024 if match else 0
+
+    def has_disk_swap(self) -> bool:
+        """Есть ли своп на диске (не zram)"""
+        swaps = read_text(self.path('proc/swaps'), '')
+        for line in swaps.splitlines()[1:]:
+            if line.split() and not line.split()[0].startswith('/dev/zram'):
+                return True
+        return False
+
+    def backend(self) -> str:
+        """Выбор бэкенда: zswap поверх дискового свопа, иначе zram"""
+        if self.has_disk_swap() and os.path.exists(self.path('sys/module/zswap/parameters/enabled')):
+            return 'zswap'
+        return 'zram'
+
+    def zram_size_mb(self) -> int:
+        """Размер zram: вся RAM до 4 ГБ, далее половина, но не больше 16 ГБ"""
+        ram = self.total_ram_mb()
+        if ram <= 4096:
+            return ram
+        return min(ram // 2, 16384)
+
+    def plan(self) -> Dict:
+        """План изменений: значения sysfs, drop-in файлы и команды"""
+        backend = self.backend()
+        swappiness = self.SWAPPINESS[backend]
+
+        sysfs = {
+            'sys/kernel/mm/transparent_hugepage/enabled': 'madvise',
+            'sys/kernel/mm/transparent_hugepage/defrag': 'defer+madvise',
+            'sys/kernel/mm/lru_gen/enabled': 'y',
+            'sys/kernel/mm/lru_gen/min_ttl_ms': '1000',
+        }
+        if backend == 'zswap':
+            sysfs['sys/module/zswap/parameters/enabled'] = 'Y'
+            sysfs['sys/module/zswap/parameters/compressor'] = 'zstd'
+            sysfs['sys/module/zswap/parameters/max_pool_percent'] = '20'
+        sysfs = {rel: value for rel, value in sysfs.items() if os.path.exists(self.path(rel))}
+
+        sysctls = {'vm.swappiness': str(swappiness)}
+        if backend == 'zram':
+            # Для zram чтение страниц пачками только мешает
+            sysctls['vm.page-cluster'] = '0'
+        sysctl_lines = [f"{key} = {value}" for key, value in sysctls.items()]
+
+        tmpfiles = [f"w /{rel} - - - - {value}" for rel, value in sysfs.items()]
+
+        # sysctl применяем через /proc/sys, чтобы apply_tuning сохранил прежние значения для отката
+        for key, value in sysctls.items():
+            rel = 'proc/sys/' + key.replace('.', '/')
+            if os.path.exists(self.path(rel)):
+                sysfs[rel] = value
+
+        plan = {
+            'backend': backend,
+            'sysfs': {self.path(rel): value for rel, value in sysfs.items()},
+            'files': {
+                self.path(self.SYSCTL_DROPIN): "# WexTweaks: память\n" + "\n".join(sysctl_lines) + "\n",
+                self.path(self.TMPFILES_DROPIN): "# WexTweaks: THP, MGLRU, zswap\n" + "\n".join(tmpfiles) + "\n",
+            },
+            'commands': [],
+            'revert_commands': ["sysctl --system"],
+        }
+
+        if backend == 'zram':
+            plan['zram_size_mb'] = self.zram_size_mb()
+            plan['files'][self.path(self.ZRAM_DROPIN)] = (
+                "# WexTweaks: zram\n"
+                "[zram0]\n"
+                f"zram-size = {plan['zram_size_mb']}\n"
+                "compression-algorithm = zstd\n"
+                "swap-priority = 100\n"
+            )
+            plan['commands'] += [
+                "systemctl daemon-reload",
+                "systemctl restart systemd-zram-setup@zram0.service",
+            ]
+            plan['revert_commands'] = [
+                "systemctl stop systemd-zram-setup@zram0.service",
+                "systemctl daemon-reload",
+            ] + plan['revert_commands']
+        return plan
+
+
+def kernel_module_available(name: str, root: str = '/') -> bool:
+    """Проверка наличия модуля ядра (загружен, встроен или установлен)"""
+    if os.path.isdir(os.path.join(root, 'sys', 'module', name)):
+        return True
+    release = platform.release()
+    for index in ('modules.builtin', 'modules.dep'):
+        text = read_text(os.path.join(root, 'lib', 'modules', release, index), '')
+        if re.search(rf'/{name}\.ko', text):
+            return True
+    return False
+
+
+def read_os_release(path: str = '/etc/os-release') -> Dict[str, str]:
+    """Разбор /etc/os-release в словарь"""
+    fields = {}
+    for line in (read_text(path, '') or '').splitlines():
+        if '=' in line and not line.startswith('#'):
+            key, value = line.split('=', 1)
+            fields[key.strip()] = value.strip().strip('"\'')
+    return fields
+
+
+# Семейства дистрибутивов (ID и ID_LIKE) -> менеджер пакетов
+PACKAGE_MANAGERS = {
+    'debian': 'apt', 'ubuntu': 'apt', 'linuxmint': 'apt', 'pop': 'apt',
+    'arch': 'pacman', 'manjaro': 'pacman', 'endeavouros': 'pacman',
+    'fedora': 'dnf', 'rhel': 'dnf', 'centos': 'dnf', 'rocky': 'dnf',
+    'opensuse': 'zypper', 'suse': 'zypper',
+    'gentoo': 'emerge',
+}
+
+
+# Профили тюнинга: общая цель для модулей и загрузочных артефактов
+PROFILES = {
+    'gaming': {
+        'title': 'Игровой',
+        'governor': 'performance',
+        'epp': 'performance',
+        'schedulers': {'nvme': 'none', 'ssd': 'kyber', 'hdd': 'bfq'},
+        'read_ahead_kb': 128,
+        'sysctl': {
+            'kernel.split_lock_mitigate': '0',
+            'vm.compaction_proactiveness': '0',
+            'vm.watermark_boost_factor': '0',
+        },
+        'audio': {'quantum': 256, 'min_quantum': 64, 'rate': 48000},
+        'gpu': {'amd_level': 'manual', 'amd_profile': '3D_FULL_SCREEN', 'intel_min': 'RP1', 'intel_max': 'RP0'},
+        'cmdline': {
+            'preempt': 'full',
+            'transparent_hugepage': 'madvise',
+            'split_lock_detect': 'off',
+            'nowatchdog': None,
+            'nvme_core.default_ps_max_latency_us': '0',
+        },
+    },
+    'balanced': {
+        'title': 'Сбалансированный',
+        'governor': 'schedutil',
+        'epp': 'balance_performance',
+        'schedulers': {'nvme': 'none', 'ssd': 'mq-deadline', 'hdd': 'bfq'},
+        'read_ahead_kb': 256,
+        'sysctl': {},
+        'audio': {'quantum': 512, 'min_quantum': 128, 'rate': 48000},
+        'gpu': {'amd_level': 'auto', 'amd_profile': None, 'intel_min': 'RPn', 'intel_max': 'RP0'},
+        'cmdline': {
+            'preempt': 'voluntary',
+            'transparent_hugepage': 'madvise',
+        },
+    },
+    'powersave': {
+        'title': 'Энергосбережение',
+        'governor': 'powersave',
+        'epp': 'power',
+        'schedulers': {'nvme': 'none', 'ssd': 'mq-deadline', 'hdd': 'bfq'},
+        'read_ahead_kb': 512,
+        'sysctl': {'vm.dirty_writeback_centisecs': '6000'},
+        'audio': {'quantum': 1024, 'min_quantum': 256, 'rate': 48000},
+        'gpu': {'amd_level': 'manual', 'amd_profile': 'POWER_SAVING', 'intel_min': 'RPn', 'intel_max': 'RP1'},
+        'cmdline': {
+            'transparent_hugepage': 'madvise',
+            'pcie_aspm': 'powersave',
+        },
+    },
+}
+
+
+def tcp_loopback_probe(rounds: int = 2000, payload: int = 64, bulk_mb: int = 32,
+                       congestion: Optional[str] = None, timeout: float = 10.0) -> Dict:
+    """Замер задержки (ping-pong) и пропускной способности TCP через loopback"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.settimeout(timeout)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+
+    def serve():
+        try:
+            conn, _ = server.accept()
+        except OSError:
+            return
+        conn.settimeout(timeout)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            try:
+                exchange(conn)
+            except OSError:
+                pass
+
+    def exchange(conn):
+        for _ in range(rounds):
+            data = b''
+            while len(data) < payload:
+                chunk = conn.recv(payload - len(data))
+                if not chunk:
+                    return
+                data += chunk
+            conn.sendall(data)
+        # Фаза пропускной способности: читаем до закрытия
+        while conn.recv(1 << 20):
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    client = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if congestion and hasattr(socket, 'TCP_CONGESTION'):
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, congestion.encode())
+
+    message = b'x' * payload
+    samples = []
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            client.sendall(message)
+            received = 0
+            while received < payload:
+                chunk = client.recv(payload - received)
+                if not chunk:
+                    raise ConnectionError("сервер замера закрыл соединение")
+                received += len(chunk)
+            samples.append((time.perf_counter() - start) * 1e6)
+
+        block = b'\0' * (1 << 20)
+        start = time.perf_counter()
+        for _ in range(bulk_mb):
+            client.sendall(block)
+        client.shutdown(socket.SHUT_WR)
+        thread.join(timeout=30)
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+        server.close()
+
+    samples.sort()
+    return {
+        'p50_us': samples[len(samples) // 2],
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        'throughput_mbps': bulk_mb * 8 / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+class NetworkTuner(RootedTree):
+    """Выбор qdisc, контроля перегрузки TCP и размеров буферов"""
+
+    SYSCTL_DROPIN = 'etc/sysctl.d/99-wextweaks-network.conf'
+    MODULES_DROPIN = 'etc/modules-load.d/wextweaks-network.conf'
+
+    # RTT для расчета BDP: с запасом для игровых серверов в другом регионе
+    TARGET_RTT = 0.1
+    MIN_BUFFER = 4 * 1024 * 1024
+    MAX_BUFFER = 64 * 1024 * 1024
+
+    # Группы ключей, которые проверяются замером по отдельности
+    GROUPS = {
+        'контроль перегрузки': ['net.ipv4.tcp_congestion_control'],
+        'буферы TCP': ['net.core.rmem_max', 'net.core.wmem_max', 'net.ipv4.tcp_rmem', 'net.ipv4.tcp_wmem'],
+        'tcp_notsent_lowat': ['net.ipv4.tcp_notsent_lowat'],
+    }
+    # lo работает без qdisc (noqueue), а default_qdisc влияет только на новые интерфейсы
+    UNMEASURED = ['net.core.default_qdisc']
+
+    def module_available(self, name: str) -> bool:
+        """Проверка наличия модуля ядра"""
+        return kernel_module_available(name, self.root)
+
+    def link_speed_mbps(self) -> int:
+        """Максимальная скорость физических интерфейсов в состоянии up"""
+        net_dir = self.path('sys/class/net')
+        best = 0
+        if not os.path.isdir(net_dir):
+            return 1000
+        for iface in os.listdir(net_dir):
+            base = os.path.join(net_dir, iface)
+            # Виртуальные интерфейсы (lo, veth, bridge) не имеют device
+            if not os.path.exists(os.path.join(base, 'device')):
+                continue
+            if read_text(os.path.join(base, 'operstate')) != 'up':
+                continue
+            try:
+                speed = int(read_text(os.path.join(base, 'speed'), '-1'))
+            except ValueError:
+                speed = -1
+            # Wi-Fi и часть драйверов не сообщают скорость
+            best = max(best, speed if speed > 0 else 1000)
+        return best or 1000
+
+    def congestion_control(self) -> str:
+        """BBR, если модуль доступен, иначе cubic"""
+        available = read_text(self.path('proc/sys/net/ipv4/tcp_available_congestion_control'), '')
+        if 'bbr' in available.split() or self.module_available('tcp_bbr'):
+            return 'bbr'
+        return 'cubic'
+
+    def qdisc(self, congestion: str) -> str:
+        """fq для BBR (pacing), cake при наличии, иначе fq_codel"""
+        if congestion == 'bbr':
+            return 'fq'
+        if self.module_available('sch_cake'):
+            return 'cake'
+        return 'fq_codel'
+
+    def buffer_size(self, speed_mbps: int) -> int:
+        """Размер буфера по BDP (x2 на окно) в пределах 4-64 МБ"""
+        bdp = int(speed_mbps * 1_000_000 / 8 * self.TARGET_RTT * 2)
+        return max(self.MIN_BUFFER, min(self.MAX_BUFFER, bdp))
+
+    def sysctl_path(self, key: str) -> str:
+        """Путь ключа sysctl в /proc/sys"""
+        return self.path('proc/sys/' + key.replace('.', '/'))
+
+    def plan(self, skip: Optional[List[str]] = None) -> Dict:
+        """План изменений сетевого стека; skip - ключи, отвергнутые замером"""
+        skip = skip or []
+        congestion = self.congestion_control()
+        qdisc = self.qdisc(congestion)
+        speed = self.link_speed_mbps()
+        buffer = self.buffer_size(speed)
+
+        sysctls = {
+            'net.core.default_qdisc': qdisc,
+            'net.ipv4.tcp_congestion_control': congestion,
+            'net.core.rmem_max': str(buffer),
+            'net.core.wmem_max': str(buffer),
+            'net.ipv4.tcp_rmem': f"4096 131072 {buffer}",
+            'net.ipv4.tcp_wmem': f"4096 16384 {buffer}",
+            'net.ipv4.tcp_notsent_lowat': '131072',
+        }
+        sysctls = {key: value for key, value in sysctls.items() if key not in skip}
+        sysfs = {}
+        for key, value in sysctls.items():
+            path = self.sysctl_path(key)
+            if os.path.exists(path):
+                sysfs[path] = value
+
+        lines = [f"{key} = {value}" for key, value in sysctls.items()]
+        plan = {
+            'congestion': congestion,
+            'qdisc': qdisc,
+            'speed_mbps': speed,
+            'buffer': buffer,
+            'pre_commands': [],
+            'sysfs': sysfs,
+            'files': {
+                self.path(self.SYSCTL_DROPIN): "# WexTweaks: сеть\n" + "\n".join(lines) + "\n",
+            },
+            'commands': [],
+            'revert_commands': ["sysctl --system"],
+        }
+        modules = []
+        if congestion == 'bbr' and 'net.ipv4.tcp_congestion_control' in sysctls:
+            modules.append('tcp_bbr')
+        if qdisc == 'cake' and 'net.core.default_qdisc' in sysctls:
+            modules.append('sch_cake')
+        if modules:
+            plan['pre_commands'] = [f"modprobe {module}" for module in modules]
+            plan['files'][self.path(self.MODULES_DROPIN)] = "\n".join(modules) + "\n"
+        return plan
+
+
+class _NullSpan:
+    """Пустой span при выключенной трассировке"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Интервал трассировки: время начала, длительность и аргументы"""
+
+    def __init__(self, tracer, name: str, category: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.tid = threading.get_ident()
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.category, self.start, time.perf_counter() - self.start,
+                        self.args, self.tid)
+        return False
+
+    def __setitem__(self, key, value):
+        self.args[key] = value
+
+
+class Tracer:
+    """Трассировка шагов, процессов и файловых операций (формат Chrome trace)"""
+
+    # Значения WEXTWEAKS_TRACE / --trace
+    OFF = ('', '0', 'false', 'no', 'off')
+    ON = ('1', 'true', 'yes', 'on')
+
+    def __init__(self, target: Optional[str] = None):
+        self.enabled = False
+        self.target = None
+        self.events: List[Dict] = []
+        self.origin = time.perf_counter()
+        if target is not None:
+            self.enable(target)
+
+    def enable(self, target: str = '1'):
+        """Включение; target - путь к файлу, '1'/'true' для пути по умолчанию, '0'/'false' - выкл."""
+        value = target.strip()
+        if value.lower() in self.OFF:
+            return
+        self.enabled = True
+        self.target = None if value.lower() in self.ON else value
+        self.origin = time.perf_counter()
+
+    def span(self, name: str, category: str, **args):
+        """Контекстный менеджер интервала; при выключенной трассировке ничего не стоит"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, category, args)
+
+    def add(self, name: str, category: str, start: float, duration: float,
+            args: Optional[Dict] = None, tid: Optional[int] = None):
+        """Запись готового интервала (start - значение time.perf_counter)"""
+        if not self.enabled:
+            return
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(), 'tid': tid or threading.get_ident(),
+            'args': args or {},
+        })
+
+    def export(self, path: str):
+        """Сохранение в формате Chrome trace (chrome://tracing, Perfetto)"""
+        write_text(path, json.dumps({'traceEvents': self.events, 'displayTimeUnit': 'ms'}))
+
+    def summary(self) -> List[Dict]:
+        """Сводка по (категория, имя), от самых долгих"""
+        rows = {}
+        for event in self.events:
+            row = rows.setdefault((event['cat'], event['name']), {
+                'category': event['cat'], 'name': event['name'],
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'bytes': 0, 'failed': 0})
+            duration = event['dur'] / 1000
+            row['count'] += 1
+            row['total_ms'] += duration
+            row['max_ms'] = max(row['max_ms'], duration)
+            row['bytes'] += event['args'].get('bytes', 0)
+            if event['args'].get('error') or event['args'].get('returncode') not in (None, 0):
+                row['failed'] += 1
+        return sorted(rows.values(), key=lambda row: row['total_ms'], reverse=True)
+
+
+TRACER = Tracer(os.environ.get('WEXTWEAKS_TRACE'))
+
+
+def traced(func):
+    """Декоратор шага: интервал трассировки на каждый вызов метода"""
+    def wrapper(self, *args, **kwargs):
+        if not TRACER.enabled:
+            return func(self, *args, **kwargs)
+        target = {'target': args[0]} if args and isinstance(args[0], str) else {}
+        with TRACER.span(func.__name__, 'step', **target):
+            return func(self, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class CommandExecutor:
+    """Асинхронный запуск команд: потоковый вывод, таймауты и ограничение параллелизма"""
+
+    def __init__(self, on_line=None, concurrency: int = 4):
+        self.on_line = on_line or (lambda stream, line: None)
+        self.concurrency = concurrency
+
+    async def _pump(self, reader, stream: str, sink: List[str]):
+        """Построчное чтение потока с передачей в лог"""
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            text = line.decode(errors='replace').rstrip('\n')
+            sink.append(text)
+            self.on_line(stream, text)
+
+    @staticmethod
+    async def _stop(proc):
+        """Завершение процесса: сначала SIGTERM, затем SIGKILL"""
+        if proc.returncode is not None:
+            return
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), 5)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def run_async(self, cmd, shell: bool = False, timeout: Optional[float] = 300,
+                        semaphore: Optional[asyncio.Semaphore] = None) -> Dict:
+        """Запуск одной команды (argv или строка для shell)"""
+        if semaphore is not None:
+            async with semaphore:
+                return await self.run_async(cmd, shell, timeout)
+
+        result = {'cmd': cmd, 'returncode': None, 'stdout': [], 'stderr': [],
+                  'timed_out': False, 'duration': 0.0}
+        label = cmd if isinstance(cmd, str) else ' '.join(cmd)
+        with TRACER.span(label.split()[0] if label.strip() else label, 'subprocess', cmd=label) as span:
+            await self._run_process(cmd, shell, timeout, result)
+            span['returncode'] = result['returncode']
+            span['timed_out'] = result['timed_out']
+            if result.get('pid'):
+                # Параллельные процессы - на отдельных дорожках
+                span.tid = result['pid']
+        return result
+
+    async def _run_process(self, cmd, shell: bool, timeout: Optional[float], result: Dict):
+        """Запуск процесса с потоковым чтением вывода"""
+        start = time.perf_counter()
+        try:
+            if shell:
+                proc = await asyncio.create_subprocess_shell(
+                    cmd, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            else:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            result['returncode'] = 127
+            result['stderr'].append(str(e))
+            return
+
+        result['pid'] = proc.pid
+        waiter = asyncio.gather(
+            self._pump(proc.stdout, 'stdout', result['stdout']),
+            self._pump(proc.stderr, 'stderr', result['stderr']),
+            proc.wait())
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            result['timed_out'] = True
+            await self._stop(proc)
+        except asyncio.CancelledError:
+            # Ctrl+C: не оставляем дочерние процессы висеть
+            await self._stop(proc)
+            await asyncio.gather(waiter, return_exceptions=True)
+            raise
+        finally:
+            result['duration'] = time.perf_counter() - start
+
+        result['returncode'] = proc.returncode
+
+    def run(self, cmd, shell: bool = False, timeout: Optional[float] = 300) -> Dict:
+        """Синхронный запуск одной команды"""
+        return asyncio.run(self.run_async(cmd, shell, timeout))
+
+    def run_many(self, commands: List, shell: bool = False, timeout: Optional[float] = 300) -> List[Dict]:
+        """Параллельный запуск независимых команд (не более concurrency одновременно)"""
+        async def main():
+            semaphore = asyncio.Semaphore(self.concurrency)
+            return await asyncio.gather(*(self.run_async(cmd, shell, timeout, semaphore)
+                                          for cmd in commands))
+        return asyncio.run(main())
+
+
+def parse_sysctl_conf(text: str) -> List[Tuple[str, str]]:
+    """Разбор строк 'ключ = значение' из sysctl.conf"""
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')) or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        entries.append((key.strip().lstrip('-'), value.strip()))
+    return entries
+
+
+class PrivilegedHelper:
+    """Привилегированный помощник: узкий набор типизированных операций от root"""
+
+    FILE_PREFIXES = ('/etc/', '/boot/', '/efi/', '/usr/local/libexec/wextweaks/')
+    SYSFS_PREFIXES = ('/sys/', '/proc/sys/')
+    DIR_PREFIXES = ('/etc/', '/sys/fs/cgroup/')
+
+    # autoremove/clean - обслуживание кэша и сирот для clean_system
+    PACKAGE_COMMANDS = {
+        'apt': {'install': ['apt-get', 'install', '-y'], 'remove': ['apt-get', 'remove', '-y'],
+                'autoremove': ['apt-get', 'autoremove', '-y'], 'clean': ['apt-get', 'clean']},
+        'pacman': {'install': ['pacman', '-S', '--noconfirm', '--needed'], 'remove': ['pacman', '-R', '--noconfirm'],
+                   'autoremove': ['pacman', '-Rns', '--noconfirm'], 'clean': ['pacman', '-Sc', '--noconfirm']},
+        'dnf': {'install': ['dnf', 'install', '-y'], 'remove': ['dnf', 'remove', '-y'],
+                'autoremove': ['dnf', 'autoremove', '-y'], 'clean': ['dnf', 'clean', 'all']},
+        'zypper': {'install': ['zypper', 'install', '-y'], 'remove': ['zypper', 'remove', '-y'],
+                   'clean': ['zypper', 'clean', '--all']},
+        # Без --ask: у помощника нет терминала
+        'emerge': {'install': ['emerge', '--noreplace', '-v'], 'remove': ['emerge', '--depclean', '-v']},
+    }
+
+    # Системные команды планов тюнинга: каждый аргумент сверяется с шаблоном (fullmatch)
+    SYSTEM_COMMANDS = [
+        ['modprobe', r'(tcp_bbr|sch_cake)'],
+        ['systemctl', 'daemon-reload'],
+        ['systemctl', 'set-property', '--runtime', r'(system\.slice|init\.scope|user\.slice)',
+         r'AllowedCPUs=[0-9,\-]*'],
+        ['systemctl', '(enable|disable|restart|stop)',
+         r'(wextweaks-boot|systemd-zram-setup@zram0)\.service'],
+        ['sysctl', '-p'],
+        ['sysctl', '--system'],
+        ['sysctl', '-p', r'/etc/sysctl\.d/[0-9A-Za-z_-]+\.conf'],
+        ['/usr/lib/systemd/systemd-sysctl', r'/etc/sysctl\.d/[0-9A-Za-z_-]+\.conf'],
+        ['udevadm', 'control', '--reload'],
+        ['udevadm', 'trigger', '--subsystem-match=block', '--action=change'],
+        ['update-grub'],
+        ['grub-mkconfig', '-o', r'/boot/grub/grub\.cfg'],
+        ['grub2-mkconfig', '-o', r'/boot/grub2/grub\.cfg'],
+        # Обслуживание ФС и очистка логов
+        ['tune2fs', '-O', '(dir_index|has_journal)', r'/dev/[\w/.-]+'],
+        ['btrfs', 'filesystem', 'defrag', '-r', '/'],
+        ['xfs_fsr', '/'],
+        ['find', '/var/log', '-type', 'f', '-name', r'\*\.log', '-mtime', r'\+30', '-delete'],
+        ['find', '/var/log', '-type', 'f', '-name', r'\*\.gz', '-delete'],
+        ['journalctl', '--vacuum-time=7d'],
+        ['systemd-tmpfiles', '--clean'],
+        ['visudo', '-cf', r'/etc/sudoers\.d/wextweaks-gamemode'],
+    ]
+
+    def __init__(self, emit=None):
+        self.emit = emit or (lambda stream, line: None)
+
+    @staticmethod
+    def check_path(path: str, prefixes: Tuple[str, ...]) -> str:
+        """Проверка пути по списку разрешенных префиксов"""
+        real = os.path.realpath(path)
+        if not os.path.isabs(path) or not real.startswith(prefixes):
+            raise ValueError(f"Путь не разрешен: {path}")
+        return real
+
+    def handle(self, request: Dict) -> Dict:
+        """Выполнение одной операции; ошибки возвращаются, а не выбрасываются"""
+        handler = getattr(self, 'op_' + str(request.get('op')), None)
+        if handler is None:
+            return {'ok': False, 'error': f"Неизвестная операция: {request.get('op')}"}
+        args = {k: v for k, v in request.items() if k != 'op'}
+        start = time.perf_counter()
+        try:
+            result = handler(**args) or {}
+        except (OSError, ValueError, TypeError) as e:
+            result = {'ok': False, 'error': str(e)}
+        result.setdefault('ok', True)
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+    def op_write_file(self, path: str, content: str, mode: Optional[int] = None) -> Dict:
+        """Атомарная запись файла: временный файл в том же каталоге + rename"""
+        path = self.check_path(path, self.FILE_PREFIXES)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if mode is None:
+            mode = os.stat(path).st_mode & 0o7777 if os.path.exists(path) else 0o644
+        tmp = os.path.join(directory, f".{os.path.basename(path)}.wextweaks.tmp")
+        try:
+            with open(tmp, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return {'bytes': len(content.encode())}
+
+    def op_remove_file(self, path: str) -> Dict:
+        """Удаление файла"""
+        path = self.check_path(path, self.FILE_PREFIXES)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def op_make_dir(self, path: str) -> Dict:
+        """Создание каталога (drop-in или cgroup)"""
+        os.makedirs(self.check_path(path, self.DIR_PREFIXES), exist_ok=True)
+        return {}
+
+    def op_remove_dir(self, path: str) -> Dict:
+        """Удаление пустого каталога (cgroup удаляется только через rmdir)"""
+        path = self.check_path(path, self.DIR_PREFIXES)
+        if os.path.isdir(path):
+            os.rmdir(path)
+        return {}
+
+    def op_write_sysfs(self, path: str, value: str) -> Dict:
+        """Запись атрибута sysfs/procfs (без rename - sysfs его не поддерживает)"""
+        with open(self.check_path(path, self.SYSFS_PREFIXES), 'w') as f:
+            f.write(str(value))
+        return {}
+
+    def op_set_sysctl(self, key: str, value: str) -> Dict:
+        """Установка sysctl по имени ключа"""
+        if not re.fullmatch(r'[a-z0-9_\-]+(\.[A-Za-z0-9_\-]+)+', key):
+            raise ValueError(f"Некорректный ключ sysctl: {key}")
+        return self.op_write_sysfs('/proc/sys/' + key.replace('.', '/'), str(value))
+
+    def op_package_transaction(self, manager: str, action: str, packages: List[str]) -> Dict:
+        """Установка/удаление пакетов с потоковой передачей вывода"""
+        if manager not in self.PACKAGE_COMMANDS or action not in self.PACKAGE_COMMANDS[manager]:
+            raise ValueError(f"Транзакция не разрешена: {manager} {action}")
+        for package in packages:
+            if not re.fullmatch(r'[A-Za-z0-9@+][A-Za-z0-9@._+:/=-]*', package):
+                raise ValueError(f"Некорректное имя пакета: {package}")
+
+        return self.stream(self.PACKAGE_COMMANDS[manager][action] + list(packages))
+
+    def op_run_command(self, argv: List[str]) -> Dict:
+        """Запуск системной команды из списка разрешенных"""
+        argv = [str(arg) for arg in argv]
+        for pattern in self.SYSTEM_COMMANDS:
+            if len(pattern) == len(argv) and all(re.fullmatch(p, a) for p, a in zip(pattern, argv)):
+                return self.stream(argv)
+        raise ValueError(f"Команда не разрешена: {' '.join(argv)}")
+
+    def stream(self, cmd: List[str]) -> Dict:
+        """Выполнение команды с потоковой передачей вывода"""
+        start = time.perf_counter()
+        output = []
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True)
+        for line in proc.stdout:
+            line = line.rstrip('\n')
+            output.append(line)
+            self.emit('stdout', line)
+        proc.wait()
+        return {'ok': proc.returncode == 0, 'cmd': cmd, 'returncode': proc.returncode,
+                'stdout': output, 'duration': time.perf_counter() - start}
+
+
+def run_helper():
+    """Цикл помощника: JSON-запрос в строке stdin -> JSON-ответ в stdout"""
+    def emit(stream, line):
+        print(json.dumps({'stream': stream, 'line': line}), flush=True)
+
+    helper = PrivilegedHelper(emit)
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+            results = [helper.handle(op) for op in request.get('ops', [])]
+        except (ValueError, AttributeError) as e:
+            results = [{'ok': False, 'error': f"Некорректный запрос: {e}"}]
+        print(json.dumps({'results': results}), flush=True)
+
+
+class PrivilegedClient:
+    """Клиент помощника: один sudo на сеанс, пакетные запросы через pipe"""
+
+    def __init__(self, on_line=None):
+        self.on_line = on_line or (lambda stream, line: None)
+        self.proc = None
+        self.local = None
+
+    def start(self):
+        """Запуск помощника (от root - в том же процессе)"""
+        if os.geteuid() == 0:
+            self.local = PrivilegedHelper(self.on_line)
+            return
+        self.proc = subprocess.Popen(
+            ['sudo', sys.executable, os.path.abspath(__file__), '--helper'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def call(self, ops: List[Dict]) -> List[Dict]:
+        """Выполнение пачки операций за один обмен"""
+        if not ops:
+            return []
+        if not TRACER.enabled:
+            return self.exchange(ops)
+        
+        start = time.perf_counter()
+        with TRACER.span('helper', 'helper', ops=len(ops)):
+            results = self.exchange(ops)
+        # Длительность каждой операции меряет сам помощник; раскладываем их внутри пачки
+        offset = start
+        for op, result in zip(ops, results):
+            elapsed = result.get('elapsed', 0.0)
+            args = {'path': op.get('path') or op.get('key', ''), 'ok': result.get('ok', False)}
+            if 'content' in op or 'value' in op:
+                args['bytes'] = len(str(op.get('content', op.get('value'))).encode())
+            if not result.get('ok'):
+                args['error'] = result.get('error', '')
+            if 'returncode' in result:
+                args['returncode'] = result['returncode']
+            category = {'package_transaction': 'package', 'run_command': 'subprocess'}.get(op.get('op'), 'file')
+            if op.get('op') == 'run_command':
+                args['path'] = ' '.join(op.get('argv', []))
+            TRACER.add(op.get('op', '?'), category, offset, elapsed, args)
+            offset += elapsed
+        return results
+
+    def exchange(self, ops: List[Dict]) -> List[Dict]:
+        """Обмен с помощником (или выполнение в процессе при запуске от root)"""
+        if self.local is None and (self.proc is None or self.proc.poll() is not None):
+            self.start()
+        if self.local is not None:
+            return [self.local.handle(op) for op in ops]
+
+        try:
+            self.proc.stdin.write(json.dumps({'ops': ops}) + '\n')
+            self.proc.stdin.flush()
+            for line in self.proc.stdout:
+                message = json.loads(line)
+                if 'results' in message:
+                    return message['results']
+                self.on_line(message.get('stream', 'stdout'), message.get('line', ''))
+        except (OSError, ValueError) as e:
+            raise OSError(f"Сбой связи с помощником: {e}")
+        raise OSError("Помощник завершился (нет прав sudo?)")
+
+    def close(self):
+        """Остановка помощника"""
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+
+
+class BootProfileCompiler(RootedTree):
+    """Сборка профиля в статические артефакты загрузки (без Python при старте)"""
+
+    SYSCTL_FILE = 'etc/sysctl.d/90-wextweaks-profile.conf'
+    TMPFILES_FILE = 'etc/tmpfiles.d/wextweaks-profile.conf'
+    UDEV_FILE = 'etc/udev/rules.d/60-wextweaks-profile.rules'
+    UNIT_NAME = 'wextweaks-boot.service'
+    UNIT_FILE = 'etc/systemd/system/' + UNIT_NAME
+    CHECKSUM_FILE = 'etc/wextweaks/profile.sha256'
+    # intel_pstate и amd-pstate в активном режиме знают только performance и powersave (с EPP)
+    GOVERNOR_FALLBACKS = {'schedutil': ['ondemand', 'powersave']}
+
+    def cpufreq_dirs(self) -> List[str]:
+        """Каталоги cpufreq всех CPU"""
+        return sorted(str(p) for p in Path(self.path('sys/devices/system/cpu')).glob('cpu[0-9]*/cpufreq'))
+
+    def resolve(self, profile: Dict) -> Dict:
+        """Профиль с governor и EPP, которые поддерживает драйвер cpufreq (None - не задавать)"""
+        dirs = self.cpufreq_dirs()
+        base = dirs[0] if dirs else ''
+        governors = (read_text(os.path.join(base, 'scaling_available_governors'), '') or '').split()
+        preferences = (read_text(os.path.join(base, 'energy_performance_available_preferences'), '') or '').split()
+        candidates = [profile['governor']] + self.GOVERNOR_FALLBACKS.get(profile['governor'], [])
+        resolved = dict(profile)
+        resolved['governor'] = next((governor for governor in candidates if governor in governors), None)
+        resolved['epp'] = profile['epp'] if profile['epp'] in preferences else None
+        return resolved
+
+    def runtime(self, profile: Dict) -> Dict[str, str]:
+        """Значения профиля для текущей загрузки: путь sysfs/procfs -> значение"""
+        sysfs = {}
+        dirs = self.cpufreq_dirs()
+        # Сначала governor: в режиме performance intel_pstate не дает менять EPP
+        for attribute, value in (('scaling_governor', profile['governor']),
+                                 ('energy_performance_preference', profile['epp'])):
+            if value:
+                sysfs.update({os.path.join(d, attribute): value for d in dirs})
+        for key, value in profile['sysctl'].items():
+            path = self.path('proc/sys/' + key.replace('.', '/'))
+            if os.path.exists(path):
+                sysfs[path] = value
+        return sysfs
+
+    def render_sysctl(self, profile: Dict) -> str:
+        """sysctl.d: применяется systemd-sysctl при загрузке"""
+        lines = [f"{key} = {value}" for key, value in sorted(profile['sysctl'].items())]
+        # '-' перед ключом: отсутствующий на этом ядре параметр не считается ошибкой
+        return "# WexTweaks: профиль\n" + "".join(f"-{line}\n" for line in lines)
+
+    def render_tmpfiles(self, profile: Dict) -> str:
+        """tmpfiles.d: атрибуты sysfs (glob покрывает все CPU)"""
+        cpufreq = '/sys/devices/system/cpu/cpu*/cpufreq'
+        lines = ["# WexTweaks: профиль\n"]
+        if profile['governor']:
+            lines.append(f"w- {cpufreq}/scaling_governor - - - - {profile['governor']}\n")
+        if profile['epp']:
+            lines.append(f"w- {cpufreq}/energy_performance_preference - - - - {profile['epp']}\n")
+        return "".join(lines)
+
+    def render_udev(self, profile: Dict) -> str:
+        """udev: планировщик ввода-вывода и read-ahead для каждого диска"""
+        schedulers = profile['schedulers']
+        read_ahead = profile['read_ahead_kb']
+        return (
+            "# WexTweaks: профиль\n"
+            'ACTION=="add|change", KERNEL=="nvme[0-9]*n[0-9]*", ENV{DEVTYPE}=="disk", '
+            f'ATTR{{queue/scheduler}}="{schedulers["nvme"]}", ATTR{{queue/read_ahead_kb}}="{read_ahead}"\n'
+            'ACTION=="add|change", KERNEL=="sd[a-z]*|mmcblk[0-9]*", ENV{DEVTYPE}=="disk", ATTR{queue/rotational}=="0", '
+            f'ATTR{{queue/scheduler}}="{schedulers["ssd"]}", ATTR{{queue/read_ahead_kb}}="{read_ahead}"\n'
+            'ACTION=="add|change", KERNEL=="sd[a-z]*", ENV{DEVTYPE}=="disk", ATTR{queue/rotational}=="1", '
+            f'ATTR{{queue/scheduler}}="{schedulers["hdd"]}", ATTR{{queue/read_ahead_kb}}="{read_ahead}"\n'
+        )
+
+    def render_unit(self, name: str) -> str:
+        """Oneshot-юнит: проверка контрольной суммы и повтор tmpfiles после загрузки модулей"""
+        return (
+            "[Unit]\n"
+            f"Description=WexTweaks boot profile ({name})\n"
+            "DefaultDependencies=no\n"
+            "After=systemd-modules-load.service systemd-tmpfiles-setup.service\n"
+            "Before=sysinit.target shutdown.target\n"
+            "Conflicts=shutdown.target\n"
+            f"ConditionPathExists=/{self.CHECKSUM_FILE}\n"
+            "\n"
+            "[Service]\n"
+            "Type=oneshot\n"
+            "RemainAfterExit=yes\n"
+            # '-': расхождение пишется в журнал, но не останавливает применение
+            f"ExecStart=-/usr/bin/sha256sum --quiet --check /{self.CHECKSUM_FILE}\n"
+            f"ExecStart=/usr/bin/systemd-tmpfiles --create /{self.TMPFILES_FILE}\n"
+            "\n"
+            "[Install]\n"
+            "WantedBy=sysinit.target\n"
+        )
+
+    def compile(self, name: str) -> Dict[str, str]:
+        """Все артефакты профиля: путь -> содержимое (с файлом контрольных сумм)"""
+        profile = self.resolve(PROFILES[name])
+        artifacts = {
+            self.SYSCTL_FILE: self.render_sysctl(profile),
+            self.TMPFILES_FILE: self.render_tmpfiles(profile),
+            self.UDEV_FILE: self.render_udev(profile),
+            self.UNIT_FILE: self.render_unit(name),
+        }
+        checksums = "".join(
+            f"{hashlib.sha256(content.encode()).hexdigest()}  /{relative}\n"
+            for relative, content in sorted(artifacts.items()))
+        artifacts[self.CHECKSUM_FILE] = checksums
+        return {self.path(relative): content for relative, content in artifacts.items()}
+
+    def check_drift(self, name: Optional[str] = None) -> Dict[str, str]:
+        """Сверка установленных артефактов с контрольными суммами и (для профиля name) текущих значений"""
+        drift = {}
+        if name:
+            for path, value in self.runtime(self.resolve(PROFILES[name])).items():
+                actual = read_sysfs_value(path)
+                if actual != value:
+                    drift[path] = f"{actual} вместо {value}"
+        checksums = read_text(self.path(self.CHECKSUM_FILE))
+        if checksums is None:
+            return drift
+        for line in checksums.splitlines():
+            digest, _, target = line.partition('  ')
+            try:
+                with open(self.path(target.lstrip('/')), 'rb') as f:
+                    actual = hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                drift[target] = 'отсутствует'
+                continue
+            if actual != digest:
+                drift[target] = 'изменен'
+        return drift
+
+    def plan(self, name: str) -> Dict:
+        """План установки артефактов для apply_tuning"""
+        # Текущие значения применяем через sysfs: apply_tuning сохранит прежние для отката
+        return {
+            'sysfs': self.runtime(self.resolve(PROFILES[name])),
+            'files': self.compile(name),
+            'commands': [
+                "systemctl daemon-reload",
+                f"systemctl enable {self.UNIT_NAME}",
+                f"systemctl restart {self.UNIT_NAME}",
+                f"/usr/lib/systemd/systemd-sysctl /{self.SYSCTL_FILE}",
+                "udevadm control --reload",
+                "udevadm trigger --subsystem-match=block --action=change",
+            ],
+            'revert_commands': [
+                f"systemctl disable {self.UNIT_NAME}",
+                "systemctl daemon-reload",
+                "udevadm control --reload",
+                "sysctl --system",
+            ],
+        }
+
+
+def parse_mangohud_log(path: str) -> Dict:
+    """Потоковое чтение CSV-лога MangoHud: сведения о системе и время кадров (мс)"""
+    info = {}
+    frametimes = array('d')
+    column = None
+    info_header = None
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('---'):
+                continue
+            fields = line.split(',')
+            if column is None:
+                if 'frametime' in fields:
+                    column = fields.index('frametime')
+                elif info_header is None:
+                    info_header = fields
+                else:
+                    info = dict(zip(info_header, fields))
+                continue
+            try:
+                value = float(fields[column])
+            except (IndexError, ValueError):
+                continue
+            if value > 0:
+                frametimes.append(value)
+    if column is None:
+        raise ValueError(f"{path}: не найден столбец frametime")
+    return {'path': path, 'info': info, 'frametimes': frametimes}
+
+
+def frame_stats(frametimes, stutter_factor: float = 2.0, window: int = 60) -> Dict:
+    """Средний FPS, 1%/0.1% low, перцентили времени кадра и число фризов"""
+    count = len(frametimes)
+    if not count:
+        return {'frames': 0}
+    total = sum(frametimes)
+    ordered = sorted(frametimes)
+
+    def percentile(q):
+        return ordered[min(count - 1, int(q / 100 * count))]
+
+    def low(fraction):
+        # Средний FPS по худшим кадрам (как в MangoHud/CapFrameX)
+        worst = ordered[-max(1, int(count * fraction)):]
+        return 1000 * len(worst) / sum(worst)
+
+    # Фриз: кадр дольше stutter_factor x скользящего среднего предыдущих кадров
+    stutters = 0
+    recent = deque()
+    running = 0.0
+    for value in frametimes:
+        if len(recent) == window and value > stutter_factor * running / window:
+            stutters += 1
+        recent.append(value)
+        running += value
+        if len(recent) > window:
+            running -= recent.popleft()
+
+    return {
+        'frames': count,
+        'duration_s': total / 1000,
+        'avg_fps': 1000 * count / total,
+        'low_1_fps': low(0.01),
+        'low_01_fps': low(0.001),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'p999_ms': percentile(99.9),
+        'max_ms': ordered[-1],
+        'stutters': stutters,
+    }
+
+
+# Метрика -> (подпись, больше = лучше)
+FRAME_METRICS = [
+    ('avg_fps', 'Средний FPS', True),
+    ('low_1_fps', '1% low FPS', True),
+    ('low_01_fps', '0.1% low FPS', True),
+    ('p50_ms', 'Кадр p50, мс', False),
+    ('p90_ms', 'Кадр p90, мс', False),
+    ('p99_ms', 'Кадр p99, мс', False),
+    ('p999_ms', 'Кадр p99.9, мс', False),
+    ('max_ms', 'Кадр max, мс', False),
+    ('stutters', 'Фризы', False),
+]
+
+
+def compare_frame_stats(before: Dict, after: Dict) -> List[Tuple[str, float, float, float, bool]]:
+    """Сравнение двух сессий: (подпись, до, после, изменение %, стало лучше)"""
+    rows = []
+    for key, title, higher_better in FRAME_METRICS:
+        a, b = before.get(key, 0), after.get(key, 0)
+        delta = (b - a) / a * 100 if a else 0.0
+        rows.append((title, a, b, delta, (b > a) == higher_better and b != a))
+    return rows
+
+
+class KernelCmdlinePlanner(RootedTree):
+    """Планирование параметров загрузки ядра для GRUB и systemd-boot"""
+
+    GRUB_DEFAULT = 'etc/default/grub'
+    GRUB_KEY = 'GRUB_CMDLINE_LINUX_DEFAULT'
+    KERNEL_CMDLINE = 'etc/kernel/cmdline'
+    ENTRY_DIRS = ['boot/loader/entries', 'efi/loader/entries', 'boot/efi/loader/entries']
+
+    # Токен как его видит ядро: кавычки сохраняются, незакрытая кавычка идет до конца строки
+    TOKEN = re.compile(r'(?:[^\s"]+|"[^"]*(?:"|$))+')
+    # Значение в /etc/default/grub: "..." (без подстановок $ и `), '...' или слово; затем комментарий
+    GRUB_VALUE = re.compile(r"""(?:"((?:[^"\\$`]|\\.)*)"|'([^']*)'|([^\s"'\\$`;#]*))(\s*|\s+#.*)""")
+
+    @classmethod
+    def parse(cls, cmdline: str) -> List[Tuple[str, Optional[str]]]:
+        """Разбор командной строки в пары (параметр, значение) без снятия кавычек"""
+        params = []
+        for token in cls.TOKEN.findall(cmdline or ''):
+            key, sep, value = token.partition('=')
+            params.append((key, value if sep else None))
+        return params
+
+    @staticmethod
+    def render(params: List[Tuple[str, Optional[str]]]) -> str:
+        """Сборка командной строки из пар"""
+        return ' '.join(key if value is None else f"{key}={value}" for key, value in params)
+
+    @classmethod
+    def merge(cls, cmdline: str, changes: Dict[str, Optional[str]]) -> str:
+        """Замена существующих параметров и добавление новых с сохранением порядка"""
+        params = cls.parse(cmdline)
+        keys = [key for key, _ in params]
+        merged = [(key, changes[key]) if key in changes else (key, value) for key, value in params]
+        merged += [(key, value) for key, value in changes.items() if key not in keys]
+        return cls.render(merged)
+
+    def current(self) -> Dict[str, Optional[str]]:
+        """Текущие параметры из /proc/cmdline"""
+        return dict(self.parse(read_text(self.path('proc/cmdline'), '')))
+
+    def kernel_config(self) -> str:
+        """Конфигурация текущего ядра (/boot/config-*)"""
+        return read_text(self.path(f'boot/config-{platform.release()}'), '') or ''
+
+    def cpu_flags(self) -> List[str]:
+        """Флаги процессора из /proc/cpuinfo"""
+        match = re.search(r'^flags\s*:\s*(.+)$', read_text(self.path('proc/cpuinfo'), '') or '', re.M)
+        return match.group(1).split() if match else []
+
+    def propose(self, profile: Dict, isolated: Optional[List[int]] = None) -> Dict[str, Optional[str]]:
+        """Параметры по профилю с учетом железа и возможностей ядра"""
+        proposed = dict(profile.get('cmdline', {}))
+        config = self.kernel_config()
+        flags = self.cpu_flags()
+
+        # preempt= работает только с CONFIG_PREEMPT_DYNAMIC
+        if config and 'CONFIG_PREEMPT_DYNAMIC=y' not in config:
+            proposed.pop('preempt', None)
+        if 'split_lock_detect' not in flags:
+            proposed.pop('split_lock_detect', None)
+        if not os.path.isdir(self.path('sys/class/nvme')) or not os.listdir(self.path('sys/class/nvme')):
+            proposed.pop('nvme_core.default_ps_max_latency_us', None)
+        # amd_pstate в активном режиме на Zen 2+ с CPPC
+        if 'cppc' in flags and 'AuthenticAMD' in (read_text(self.path('proc/cpuinfo'), '') or ''):
+            proposed['amd_pstate'] = 'active'
+        # Тики и RCU-колбэки убираем с изолированных игровых ядер (нужен разделенный cpuset)
+        if isolated and 'CONFIG_NO_HZ_FULL=y' in config:
+            proposed['nohz_full'] = format_cpu_list(isolated)
+            proposed['rcu_nocbs'] = format_cpu_list(isolated)
+        return proposed
+
+    def diff(self, proposed: Dict[str, Optional[str]]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """Параметры, отличающиеся от текущей загрузки: (имя, было, станет)"""
+        current = self.current()
+        changes = []
+        for key, value in proposed.items():
+            if key not in current or current[key] != value:
+                changes.append((key, current.get(key, '—'), value))
+        return changes
+
+    def entries(self) -> List[str]:
+        """Записи systemd-boot"""
+        found = []
+        for relative in self.ENTRY_DIRS:
+            directory = self.path(relative)
+            if os.path.isdir(directory):
+                found += [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                          if name.endswith('.conf')]
+        return found
+
+    def render_grub(self, text: str, changes: Dict[str, Optional[str]]) -> str:
+        """Новый /etc/default/grub с обновленной GRUB_CMDLINE_LINUX_DEFAULT (ValueError, если строку не разобрать)"""
+        lines = text.splitlines()
+        # grub-mkconfig выполняет файл как shell: действует последнее присваивание
+        index = None
+        for i, line in enumerate(lines):
+            if line.lstrip().startswith(f'{self.GRUB_KEY}='):
+                index = i
+        if index is None:
+            return '\n'.join(lines + [f'{self.GRUB_KEY}="{self.merge("", changes)}"']) + '\n'
+
+        line = lines[index]
+        indent = line[:len(line) - len(line.lstrip())]
+        match = self.GRUB_VALUE.fullmatch(line.lstrip()[len(self.GRUB_KEY) + 1:])
+        if not match:
+            raise ValueError(f"{self.GRUB_KEY}: строка не разобрана, файл не изменен: {line.strip()}")
+        double, single, bare, tail = match.groups()
+        if double is not None:
+            cmdline = re.sub(r'\\([$`"\\])', r'\1', double)
+        else:
+            cmdline = single if single is not None else bare
+        merged = re.sub(r'([$`"\\])', r'\\\1', self.merge(cmdline, changes))
+        lines[index] = f'{indent}{self.GRUB_KEY}="{merged}"{tail}'
+        return '\n'.join(lines) + '\n'
+
+    def render_entry(self, text: str, changes: Dict[str, Optional[str]]) -> str:
+        """Запись systemd-boot с обновленной строкой options"""
+        lines = text.splitlines()
+        for i, line in enumerate(lines):
+            if line.startswith('options'):
+                lines[i] = 'options ' + self.merge(line[len('options'):].strip(), changes)
+                break
+        else:
+            lines.append('options ' + self.merge('', changes))
+        return '\n'.join(lines) + '\n'
+
+    def grub_command(self) -> str:
+        """Команда пересборки grub.cfg для дистрибутива"""
+        if os.path.isdir(self.path('boot/grub2')):
+            return "grub2-mkconfig -o /boot/grub2/grub.cfg"
+        if shutil.which('update-grub'):
+            return "update-grub"
+        return "grub-mkconfig -o /boot/grub/grub.cfg"
+
+    @staticmethod
+    def read(path: str) -> str:
+        """Чтение файла загрузчика; ошибка прерывает план, а не превращает файл в пустой"""
+        with open(path, 'r') as f:
+            return f.read()
+
+    def plan(self, changes: Dict[str, Optional[str]]) -> Dict:
+        """План изменений загрузчиков для apply_tuning (OSError/ValueError - план не составлен)"""
+        files = {}
+        commands = []
+        grub = self.path(self.GRUB_DEFAULT)
+        if os.path.exists(grub):
+            files[grub] = self.render_grub(self.read(grub), changes)
+            commands.append(self.grub_command())
+        for entry in self.entries():
+            files[entry] = self.render_entry(self.read(entry), changes)
+        kernel_cmdline = self.path(self.KERNEL_CMDLINE)
+        if os.path.exists(kernel_cmdline):
+            # Для будущих ядер, которые ставит kernel-install
+            files[kernel_cmdline] = self.merge(self.read(kernel_cmdline).strip(), changes) + '\n'
+        return {
+            'sysfs': {},
+            'files': files,
+            'commands': commands,
+            'revert_commands': list(commands),
+        }
+
+
+class AudioTuner(RootedTree):
+    """Задержка звука: quantum/rate для PipeWire, фрагменты для PulseAudio"""
+
+    PIPEWIRE_DROPIN = '.config/pipewire/pipewire.conf.d/90-wextweaks.conf'
+    PULSE_DROPIN = '.config/pipewire/pipewire-pulse.conf.d/90-wextweaks.conf'
+    PULSEAUDIO_DROPIN = '.config/pulse/daemon.conf.d/90-wextweaks.conf'
+    RATES = (44100, 48000, 88200, 96000, 192000)
+
+    def __init__(self, home: Optional[str] = None, root: str = '/'):
+        super().__init__(root)
+        self.home = home or os.path.expanduser("~")
+
+    def running(self) -> List[str]:
+        """Имена запущенных звуковых процессов из /proc/*/comm"""
+        names = set()
+        proc = self.path('proc')
+        for pid in os.listdir(proc) if os.path.isdir(proc) else []:
+            if pid.isdigit():
+                comm = read_text(os.path.join(proc, pid, 'comm'))
+                if comm in ('pipewire', 'pipewire-pulse', 'pulseaudio', 'wireplumber'):
+                    names.add(comm)
+        return sorted(names)
+
+    def server(self) -> str:
+        """Звуковой сервер: pipewire, pulseaudio или пустая строка"""
+        running = self.running()
+        # В Ubuntu 22.04 и Debian pipewire работает рядом с PulseAudio только для записи экрана
+        if 'pipewire-pulse' in running or ('pipewire' in running and 'pulseaudio' not in running):
+            return 'pipewire'
+        return 'pulseaudio' if 'pulseaudio' in running else ''
+
+    @classmethod
+    def validate(cls, settings: Dict):
+        """Проверка значений до записи: PipeWire молча игнорирует мусор"""
+        quantum, min_quantum, rate = settings['quantum'], settings['min_quantum'], settings['rate']
+        for value in (quantum, min_quantum):
+            if value & (value - 1) or not 32 <= value <= 8192:
+                raise ValueError(f"quantum должен быть степенью двойки от 32 до 8192: {value}")
+        if min_quantum > quantum:
+            raise ValueError(f"min-quantum ({min_quantum}) больше quantum ({quantum})")
+        if rate not in cls.RATES:
+            raise ValueError(f"неподдерживаемая частота: {rate}")
+
+    @staticmethod
+    def latency_ms(quantum: int, rate: int) -> float:
+        """Задержка одного периода графа"""
+        return quantum * 1000 / rate
+
+    def plan(self, settings: Dict, server: Optional[str] = None) -> Dict:
+        """План drop-in файлов пользователя и перезапуска сервера"""
+        self.validate(settings)
+        server = self.server() if server is None else server
+        quantum, min_quantum, rate = settings['quantum'], settings['min_quantum'], settings['rate']
+        header = f"# WexTweaks: {quantum}/{rate} ({self.latency_ms(quantum, rate):.1f} мс)\n"
+        files = {}
+        commands = []
+
+        if server == 'pipewire':
+            files[os.path.join(self.home, self.PIPEWIRE_DROPIN)] = header + (
+                "context.properties = {\n"
+                f"    default.clock.rate = {rate}\n"
+                f"    default.clock.allowed-rates = [ {rate} ]\n"
+                f"    default.clock.quantum = {quantum}\n"
+                f"    default.clock.min-quantum = {min_quantum}\n"
+                "}\n")
+            files[os.path.join(self.home, self.PULSE_DROPIN)] = header + (
+                "pulse.properties = {\n"
+                f"    pulse.min.req = {min_quantum}/{rate}\n"
+                f"    pulse.default.req = {quantum}/{rate}\n"
+                f"    pulse.min.quantum = {min_quantum}/{rate}\n"
+                "}\n")
+            commands.append("systemctl --user restart pipewire pipewire-pulse")
+        elif server == 'pulseaudio':
+            fragment = max(1, round(self.latency_ms(quantum, rate)))
+            files[os.path.join(self.home, self.PULSEAUDIO_DROPIN)] = header + (
+                f"default-sample-rate = {rate}\n"
+                "default-fragments = 2\n"
+                f"default-fragment-size-msec = {fragment}\n")
+            # Демон перезапускается сам через автозапуск
+            commands.append("pulseaudio -k")
+
+        return {
+            'server': server,
+            'user': True,
+            'sysfs': {},
+            'files': files,
+            'commands': commands,
+            'revert_commands': list(commands),
+        }
+
+    @staticmethod
+    def parse_metadata(text: str) -> Dict[str, str]:
+        """Разбор вывода pw-metadata -n settings"""
+        return dict(re.findall(r"key:'([^']+)' value:'([^']*)'", text))
+
+    @classmethod
+    def effective(cls, metadata: Dict[str, str]) -> Optional[Dict]:
+        """Фактические quantum, rate и задержка (force-* имеет приоритет)"""
+        try:
+            rate = int(metadata.get('clock.force-rate') or 0) or int(metadata['clock.rate'])
+            quantum = int(metadata.get('clock.force-quantum') or 0) or int(metadata['clock.quantum'])
+        except (KeyError, ValueError):
+            return None
+        return {'quantum': quantum, 'rate': rate, 'latency_ms': cls.latency_ms(quantum, rate)}
+
+
+class GpuTuner(RootedTree):
+    """Фиксация режима GPU: уровень DPM и профиль amdgpu, частоты i915/xe"""
+
+    TMPFILES_DROPIN = 'etc/tmpfiles.d/wextweaks-gpu.conf'
+    # Имена точек частоты i915 -> файлы xe
+    XE_FREQS = {'RP0': 'rp0_freq', 'RP1': 'rpe_freq', 'RPn': 'rpn_freq'}
+
+    def cards(self) -> List[Dict]:
+        """Видеокарты: имя, драйвер и каталог устройства"""
+        drm = self.path('sys/class/drm')
+        found = []
+        for name in sorted(os.listdir(drm)) if os.path.isdir(drm) else []:
+            if not re.fullmatch(r'card\d+', name):
+                continue
+            card = os.path.join(drm, name)
+            uevent = read_text(os.path.join(card, 'device', 'uevent'), '') or ''
+            match = re.search(r'^DRIVER=(\S+)', uevent, re.M)
+            found.append({'name': name, 'driver': match.group(1) if match else '',
+                          'path': card, 'device': os.path.join(card, 'device')})
+        return found
+
+    @staticmethod
+    def parse_profile_modes(text: str) -> Tuple[Dict[str, str], Optional[str]]:
+        """Таблица pp_power_profile_mode: {имя: индекс} и текущий индекс (отмечен *)"""
+        modes = {}
+        current = None
+        for line in (text or '').splitlines():
+            match = re.match(r'\s*(\d+)\s+([A-Z0-9_]+)\s*(\*?)', line)
+            if match:
+                modes[match.group(2)] = match.group(1)
+                if match.group(3):
+                    current = match.group(1)
+        return modes, current
+
+    def amd_plan(self, card: Dict, settings: Dict) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """amdgpu: уровень производительности и профиль нагрузки"""
+        level = os.path.join(card['device'], 'power_dpm_force_performance_level')
+        mode = os.path.join(card['device'], 'pp_power_profile_mode')
+        sysfs = {}
+        revert = {}
+        if os.path.exists(level) and settings.get('amd_level'):
+            sysfs[level] = settings['amd_level']
+        modes, current = self.parse_profile_modes(read_text(mode, ''))
+        if settings.get('amd_profile') in modes:
+            # Профиль записывается индексом и только в режиме manual
+            sysfs[mode] = modes[settings['amd_profile']]
+            revert[mode] = current
+        return sysfs, revert
+
+    def intel_freq_dirs(self, card: Dict) -> List[Tuple[str, Dict[str, str]]]:
+        """Каталоги частот: i915 (card/gt_*) или xe (device/tile*/gt*/freq0)"""
+        if card['driver'] == 'i915':
+            names = {point: f'gt_{point}_freq_mhz' for point in ('RP0', 'RP1', 'RPn')}
+            names.update(min='gt_min_freq_mhz', max='gt_max_freq_mhz')
+            return [(card['path'], names)]
+        dirs = []
+        for tile in sorted(os.listdir(card['device'])) if os.path.isdir(card['device']) else []:
+            tile_dir = os.path.join(card['device'], tile)
+            if not tile.startswith('tile') or not os.path.isdir(tile_dir):
+                continue
+            for gt in sorted(os.listdir(tile_dir)):
+                freq = os.path.join(tile_dir, gt, 'freq0')
+                if gt.startswith('gt') and os.path.isdir(freq):
+                    names = dict(self.XE_FREQS, min='min_freq', max='max_freq')
+                    dirs.append((freq, names))
+        return dirs
+
+    def intel_plan(self, card: Dict, settings: Dict) -> Dict[str, str]:
+        """i915/xe: нижняя и верхняя границы частоты по точкам RP0/RP1/RPn"""
+        sysfs = {}
+        for directory, names in self.intel_freq_dirs(card):
+            points = {point: read_text(os.path.join(directory, names[point]))
+                      for point in ('RP0', 'RP1', 'RPn')}
+            low, high = points.get(settings.get('intel_min')), points.get(settings.get('intel_max'))
+            min_path = os.path.join(directory, names['min'])
+            max_path = os.path.join(directory, names['max'])
+            if not (low and high and os.path.exists(min_path) and os.path.exists(max_path)):
+                continue
+            # Ядро отвергает min > max: при повышении сначала пишем max, при понижении - min
+            current_max = int(read_text(max_path, '0') or 0)
+            if int(high) >= current_max:
+                sysfs[max_path] = high
+                sysfs[min_path] = low
+            else:
+                sysfs[min_path] = low
+                sysfs[max_path] = high
+        return sysfs
+
+    def plan(self, settings: Dict) -> Dict:
+        """План для apply_tuning; неподдерживаемые карты перечисляются в skipped"""
+        sysfs = {}
+        revert = {}
+        skipped = []
+        for card in self.cards():
+            if card['driver'] == 'amdgpu':
+                card_sysfs, card_revert = self.amd_plan(card, settings)
+                sysfs.update(card_sysfs)
+                revert.update(card_revert)
+            elif card['driver'] in ('i915', 'xe'):
+                sysfs.update(self.intel_plan(card, settings))
+            else:
+                skipped.append(f"{card['name']} ({card['driver'] or 'нет драйвера'})")
+
+        tmpfiles = [f"w {path[len(self.root.rstrip('/')):]} - - - - {value}" for path, value in sysfs.items()]
+        return {
+            'sysfs': sysfs,
+            'sysfs_revert': revert,
+            'skipped': skipped,
+            'files': {
+                self.path(self.TMPFILES_DROPIN): "# WexTweaks: режим GPU\n" + "\n".join(tmpfiles) + "\n",
+            } if sysfs else {},
+            'commands': [],
+            'revert_commands': [],
+        }
+
+
+# Ключи, которые понимает gamemoded (example/gamemode.ini); списки задаются повтором ключа
+GAMEMODE_SCHEMA = {
+    'general': ['reaper_freq', 'desiredgov', 'defaultgov', 'desiredprof', 'defaultprof',
+                'igpu_desiredgov', 'igpu_power_threshold', 'disable_splitlock',
+                'softrealtime', 'renice', 'ioprio', 'inhibit_screensaver'],
+    'filter': ['whitelist', 'blacklist'],
+    'gpu': ['apply_gpu_optimisations', 'gpu_device', 'nv_powermizer_mode',
+            'nv_core_clock_mhz_offset', 'nv_mem_clock_mhz_offset', 'amd_performance_level'],
+    'cpu': ['park_cores', 'pin_cores'],
+    'supervisor': ['supervisor_whitelist', 'supervisor_blacklist', 'require_supervisor'],
+    'custom': ['start', 'end', 'script_timeout'],
+}
+GAMEMODE_LIST_KEYS = {'whitelist', 'blacklist', 'supervisor_whitelist', 'supervisor_blacklist', 'start', 'end'}
+# Ключи старого шаблона WexTweaks: файл с ними целиком наш, а не пользовательский
+GAMEMODE_LEGACY_KEYS = {'cpu governor', 'gpu_frequency', 'desktop_phosphor_disable',
+                        'apply_gamescope_to_children', 'start_delay'}
+# Хуки [custom], которые добавляет WexTweaks
+GAMEMODE_HOOK_KEYS = {'start', 'end'}
+GAMEMODE_HOOK_ARGS = (' --game-start', ' --game-end')
+
+
+def parse_gamemode_ini(text: str) -> List[Tuple[str, str, str]]:
+    """Разбор gamemode.ini в тройки (секция, ключ, значение) с сохранением порядка"""
+    entries = []
+    section = ''
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+        elif '=' in line:
+            key, value = line.split('=', 1)
+            entries.append((section, key.strip(), value.strip()))
+    return entries
+
+
+def merge_gamemode_ini(existing: str, managed: Dict[str, Dict]) -> Tuple[str, List[str], List[str]]:
+    """Слияние с конфигом пользователя по строкам; возвращает текст, неизвестные ключи и конфликты"""
+    lines = (existing or '').splitlines()
+    if any(key in GAMEMODE_LEGACY_KEYS for _, key, _ in parse_gamemode_ini(existing)):
+        lines = []
+    if not lines:
+        lines = ["# WexTweaks: сгенерировано по схеме gamemode, правки пользователя сохраняются"]
+
+    # Комментарии, порядок и чужие ключи остаются как есть; убираем только свои устаревшие хуки
+    kept = []
+    unknown = []
+    values: Dict[str, Dict[str, List[str]]] = {}
+    section = ''
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            section = stripped[1:-1].strip()
+        elif stripped and not stripped.startswith(('#', ';')) and '=' in stripped:
+            key, value = (part.strip() for part in stripped.split('=', 1))
+            if (key in GAMEMODE_HOOK_KEYS and value.endswith(GAMEMODE_HOOK_ARGS)
+                    and value not in managed.get(section, {}).get(key, [])):
+                continue
+            if key not in GAMEMODE_SCHEMA.get(section, []):
+                unknown.append(f"[{section}] {key}")
+            values.setdefault(section, {}).setdefault(key, []).append(value)
+        kept.append((section, line))
+
+    # Значения пользователя сохраняются, расхождения с нашими возвращаются; списки дополняются
+    conflicts = []
+    additions: Dict[str, List[str]] = {}
+    for section, keys in managed.items():
+        current = values.get(section, {})
+        for key, value in keys.items():
+            if key in GAMEMODE_LIST_KEYS:
+                additions.setdefault(section, []).extend(
+                    f"{key}={item}" for item in value if item not in current.get(key, []))
+            elif current.get(key):
+                if current[key][-1] != str(value):
+                    conflicts.append(f"[{section}] {key}={current[key][-1]} (WexTweaks: {value})")
+            else:
+                additions.setdefault(section, []).append(f"{key}={value}")
+
+    # Новые строки - в конец своей секции (перед пустыми строками), отсутствующие секции - в конец файла
+    last = {}
+    for i, (name, line) in enumerate(kept):
+        if line.strip():
+            last[name] = i
+    result = []
+    for i, (_, line) in enumerate(kept):
+        result.append(line)
+        for section, added in additions.items():
+            if last.get(section) == i:
+                result += added
+    for section, added in additions.items():
+        if added and section not in last:
+            result += ['', f"[{section}]"] + added
+    return "\n".join(result) + "\n", unknown, conflicts
+
+
+def root_owned_chain(path: str) -> bool:
+    """Файл и все каталоги над ним (и над целью ссылки) принадлежат root и закрыты на запись остальным"""
+    paths = set()
+    for current in (os.path.abspath(path), os.path.realpath(path)):
+        while current not in paths:
+            paths.add(current)
+            current = os.path.dirname(current)
+    try:
+        stats = [os.stat(item) for item in paths]
+    except OSError:
+        return False
+    return all(info.st_uid == 0 and not info.st_mode & 0o022 for info in stats)
+
+
+GAME_STATE_FILE = '/run/wextweaks/game.json'
+
+
+def game_profile_start(state_file: str = GAME_STATE_FILE, root: str = '/') -> int:
+    """Хук gamemode: фоновые группы на фоновые ядра, GPU в игровой режим"""
+    if os.path.exists(state_file):
+        return 0
+    state = {'cpuset': None, 'gpu': []}
+    errors = 0
+
+    proposal = CpuTopology(root).propose_split()
+    partitioner = CpusetPartitioner(root)
+    if proposal['background'] and partitioner.available():
+        created = not os.path.isdir(os.path.join(partitioner.cgroup_root, CpusetPartitioner.GAME_GROUP))
+        try:
+            previous = partitioner.apply(proposal['game'], proposal['background'])
+            state['cpuset'] = {'previous': previous, 'created': created}
+        except OSError as e:
+            print(f"cpuset: {e}", file=sys.stderr)
+            errors += 1
+
+    plan = GpuTuner(root).plan(PROFILES['gaming']['gpu'])
+    for path, value in plan['sysfs'].items():
+        previous = plan['sysfs_revert'].get(path, read_sysfs_value(path))
+        try:
+            write_text(path, value)
+            state['gpu'].append([path, previous])
+        except OSError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            errors += 1
+
+    write_text(state_file, json.dumps(state))
+    return 1 if errors else 0
+
+
+def game_profile_end(state_file: str = GAME_STATE_FILE, root: str = '/') -> int:
+    """Хук gamemode: возврат состояния, сохраненного game_profile_start"""
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    errors = 0
+
+    for path, value in reversed(state.get('gpu', [])):
+        try:
+            if value is not None:
+                write_text(path, value)
+        except OSError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            errors += 1
+
+    cpuset = state.get('cpuset')
+    if cpuset:
+        partitioner = CpusetPartitioner(root)
+        try:
+            if cpuset['created']:
+                partitioner.revert(cpuset['previous'])
+            else:
+                # Постоянное разбиение из tune_cpu_topology не трогаем
+                for group, value in cpuset['previous'].items():
+                    partitioner.restore(group, value)
+        except OSError as e:
+            print(f"cpuset: {e}", file=sys.stderr)
+            errors += 1
+
+    os.remove(state_file)
+    return 1 if errors else 0
+
+
+def run_game(argv: List[str], root: str = '/'):
+    """Лаунчер: перенос себя в игровую cpuset-группу и exec игры (потомки наследуют группу)"""
+    partitioner = CpusetPartitioner(root)
+    procs = os.path.join(partitioner.cgroup_root, CpusetPartitioner.GAME_GROUP, 'cgroup.procs')
+    if not os.path.exists(procs):
+        print("WexTweaks: разбиение CPU не применено, игра запускается без cpuset", file=sys.stderr)
+    else:
+        client = PrivilegedClient()
+        try:
+            result = client.call([{'op': 'write_sysfs', 'path': procs, 'value': str(os.getpid())}])[0]
+            if not result.get('ok'):
+                print(f"WexTweaks: не удалось перенести игру: {result.get('error')}", file=sys.stderr)
+        except OSError as e:
+            print(f"WexTweaks: не удалось перенести игру: {e}", file=sys.stderr)
+        finally:
+            client.close()
+    os.execvp(argv[0], argv)
+
+
+class CapabilityInventory(RootedTree):
+    """Инвентарь возможностей системы с кэшем на диске"""
+
+    TOOLS = [
+        'gamemoded', 'gamemoderun', 'mangohud', 'wine', 'winetricks',
+        'nvidia-smi', 'lspci', 'findmnt', 'tune2fs', 'btrfs', 'xfs_fsr',
+        'gsettings', 'kwriteconfig5', 'kwriteconfig6', 'qdbus', 'qdbus6', 'xfconf-query',
+        'systemctl', 'journalctl', 'modprobe', 'tc', 'zramctl', 'pw-metadata',
+        'apt-get', 'pacman', 'dnf', 'zypper', 'emerge',
+    ]
+    GPU_VENDORS = {'0x10de': 'nvidia', '0x1002': 'amd', '0x8086': 'intel'}
+    VERSION = 2
+
+    def __init__(self, root: str = '/', cache_file: Optional[str] = None):
+        super().__init__(root)
+        self.cache_file = cache_file
+        self.data = {}
+
+    def fingerprint(self) -> Dict:
+        """Ключ валидности кэша: mtime каталогов PATH, релиз ядра, os-release"""
+        mtimes = {}
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                continue
+        try:
+            os_release = os.stat(self.path('etc/os-release')).st_mtime
+        except OSError:
+            os_release = None
+        return {'version': self.VERSION, 'kernel': platform.release(),
+                'path': mtimes, 'os_release': os_release}
+
+    def detect_distro(self) -> Dict:
+        """Дистрибутив и его семейство с учетом ID_LIKE"""
+        fields = read_os_release(self.path('etc/os-release'))
+        ids = [fields.get('ID', 'unknown')] + fields.get('ID_LIKE', '').split()
+        family = next((i for i in ids if i in PACKAGE_MANAGERS), 'unknown')
+        return {
+            'name': fields.get('NAME', 'Unknown'),
+            'version': fields.get('VERSION_ID', 'Unknown'),
+            'id': ids[0],
+            'family': family,
+            'package_manager': PACKAGE_MANAGERS.get(family, 'unknown'),
+        }
+
+    def detect_gpus(self) -> List[Dict]:
+        """Видеокарты по /sys/class/drm (без lspci и nvidia-smi)"""
+        gpus = []
+        drm = self.path('sys/class/drm')
+        if not os.path.isdir(drm):
+            return gpus
+        for card in sorted(os.listdir(drm)):
+            if not re.fullmatch(r'card\d+', card):
+                continue
+            device = os.path.join(drm, card, 'device')
+            vendor = read_text(os.path.join(device, 'vendor'), '')
+            driver = os.path.join(device, 'driver')
+            gpus.append({
+                'card': card,
+                'vendor': self.GPU_VENDORS.get(vendor, vendor or 'unknown'),
+                'driver': os.path.basename(os.readlink(driver)) if os.path.islink(driver) else None,
+            })
+        return gpus
+
+    def detect_kernel(self) -> Dict:
+        """Возможности ядра, нужные модулям тюнинга"""
+        return {
+            'release': platform.release(),
+            'cgroup_cpuset': CpusetPartitioner(self.root).available(),
+            'zram': kernel_module_available('zram', self.root),
+            'zswap': os.path.exists(self.path('sys/module/zswap')),
+            'thp': os.path.exists(self.path('sys/kernel/mm/transparent_hugepage')),
+            'mglru': os.path.exists(self.path('sys/kernel/mm/lru_gen')),
+            'tcp_bbr': kernel_module_available('tcp_bbr', self.root),
+        }
+
+    def collect(self) -> Dict:
+        """Полный сбор инвентаря за один проход"""
+        return {
+            'tools': {tool: shutil.which(tool) for tool in self.TOOLS if shutil.which(tool)},
+            'distro': self.detect_distro(),
+            'kernel': self.detect_kernel(),
+            'gpus': self.detect_gpus(),
+        }
+
+    def load(self, refresh: bool = False) -> Dict:
+        """Загрузка из кэша или пересборка при изменении PATH/ядра"""
+        fingerprint = self.fingerprint()
+        data = None
+        if self.cache_file and not refresh and os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('fingerprint') == fingerprint:
+                    data = cached['data']
+            except (OSError, ValueError, KeyError):
+                data = None
+
+        if data is None:
+            data = self.collect()
+            if self.cache_file:
+                try:
+                    with open(self.cache_file, 'w') as f:
+                        json.dump({'fingerprint': fingerprint, 'data': data}, f, indent=2)
+                except OSError:
+                    pass
+
+        # Сеанс рабочего стола зависит от окружения процесса, его не кэшируем
+        data['desktop'] = {
+            'name': os.environ.get('XDG_CURRENT_DESKTOP', '').lower(),
+            'session': os.environ.get('XDG_SESSION_TYPE', ''),
+        }
+        self.data = data
+        return data
+
+    def has(self, tool: str) -> bool:
+        """Установлена ли утилита"""
+        return tool in self.data.get('tools', {})
+
+    def desktop(self) -> str:
+        """Окружение рабочего стола: gnome, kde, xfce или пустая строка"""
+        name = self.data.get('desktop', {}).get('name', '')
+        if 'gnome' in name or 'ubuntu' in name:
+            return 'gnome'
+        if 'kde' in name or 'plasma' in name:
+            return 'kde'
+        if 'xfce' in name:
+            return 'xfce'
+        return ''
+
+
+def states_match(current, desired) -> bool:
+    """Сравнение состояний с нормализацией пробелов и булевых значений sysfs"""
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and all(
+            states_match(current.get(key), value) for key, value in desired.items())
+    if isinstance(desired, (list, tuple)):
+        return isinstance(current, (list, tuple)) and len(current) == len(desired) and all(
+            states_match(c, d) for c, d in zip(current, desired))
+    if isinstance(desired, str) and isinstance(current, str):
+        if desired in ('y', 'Y'):
+            # lru_gen/enabled читается как маска (0x0007), zswap - как 'Y'
+            return current in ('y', 'Y', '1') or (current.startswith('0x') and int(current, 16) > 0)
+        return ' '.join(current.split()) == ' '.join(desired.split())
+    return current == desired
+
+
+class Tweak:
+    """Настройка: целевое состояние, дешевая проверка текущего и действие применения"""
+
+    def __init__(self, name: str, title: str, desired, apply, probe=None,
+                 requires: Optional[List[str]] = None, provides: Optional[List[str]] = None,
+                 skip_reason: Optional[str] = None):
+        self.name = name
+        self.title = title
+        self.desired = desired
+        self.apply = apply
+        self.probe = probe
+        self.requires = requires or []
+        self.provides = provides or []
+        # Причина, по которой шаг неприменим на этой системе (известна до запуска)
+        self.skip_reason = skip_reason
+
+    def fingerprint(self) -> str:
+        """Отпечаток целевого состояния"""
+        payload = json.dumps(self.desired, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class TweakEngine:
+    """План/применение: изменяется только то, что отличается от цели"""
+
+    ACTIONS = {
+        'create': ('+', 'GREEN', 'применить'),
+        'update': ('~', 'YELLOW', 'цель изменилась'),
+        'drift': ('~', 'YELLOW', 'состояние разошлось с целью'),
+        'noop': ('=', 'WHITE', 'без изменений'),
+    }
+
+    def __init__(self, state: Dict):
+        self.state = state
+
+    def action(self, tweak: Tweak) -> str:
+        """Что нужно сделать с настройкой"""
+        stored = self.state.get(tweak.name)
+        fingerprint = tweak.fingerprint()
+        if tweak.probe is not None:
+            if states_match(tweak.probe(), tweak.desired):
+                return 'noop'
+        elif stored == fingerprint:
+            return 'noop'
+        if stored is None:
+            return 'create'
+        return 'update' if stored != fingerprint else 'drift'
+
+    def plan(self, tweaks: List[Tweak]) -> List[Tuple[Tweak, str]]:
+        """Построение плана"""
+        return [(tweak, self.action(tweak)) for tweak in tweaks]
+
+    def apply(self, plan: List[Tuple[Tweak, str]], on_step=None) -> int:
+        """Применение изменений плана; возвращает число примененных настроек"""
+        applied = 0
+        for tweak, action in plan:
+            if action == 'noop':
+                continue
+            if on_step:
+                on_step(tweak)
+            with TRACER.span(tweak.name, 'step', action=action):
+                tweak.apply()
+            applied += 1
+            # Отпечаток записываем только если проверка подтвердила результат
+            if tweak.probe is None or states_match(tweak.probe(), tweak.desired):
+                self.state[tweak.name] = tweak.fingerprint()
+        return applied
+
 
 class LinuxTweaker:
     def __init__(self):
-        self.distro = self.detect_distro()
         self.arch = platform.machine()
         self.username = getpass.getuser()
         self.home_dir = os.path.expanduser("~")
@@ -32,6 +2198,10 @@ class LinuxTweaker:
         os.makedirs(self.config_dir, exist_ok=True)
         os.makedirs(self.backup_dir, exist_ok=True)
         
+        self.inventory = CapabilityInventory(cache_file=os.path.join(self.config_dir, "capabilities.json"))
+        self.inventory.load()
+        self.distro = self.detect_distro()
+        
         # Цвета для терминала
         self.colors = {
             'RED': '\033[91m',
@@ -47,6 +2217,8 @@ class LinuxTweaker:
         
         self.load_config()
         self.check_sudo()
+        self.executor = CommandExecutor(on_line=self.log_output)
+        self.helper = PrivilegedClient(on_line=self.log_output)
         
     def color(self, text: str, color: str) -> str:
         """Добавляет цвет к тексту"""
@@ -70,38 +2242,8 @@ class LinuxTweaker:
         os.system('clear')
     
     def detect_distro(self) -> Dict:
-        """Определение дистрибутива"""
-        distro_info = {
-            'name': 'Unknown',
-            'version': 'Unknown',
-            'id': 'unknown',
-            'package_manager': 'unknown'
-        }
-        
-        # Проверяем /etc/os-release
-        if os.path.exists('/etc/os-release'):
-            with open('/etc/os-release', 'r') as f:
-                for line in f:
-                    if line.startswith('NAME='):
-                        distro_info['name'] = line.split('=')[1].strip().strip('"')
-                    elif line.startswith('VERSION_ID='):
-                        distro_info['version'] = line.split('=')[1].strip().strip('"')
-                    elif line.startswith('ID='):
-                        distro_info['id'] = line.split('=')[1].strip().strip('"')
-        
-        # Определяем менеджер пакетов
-        if distro_info['id'] in ['ubuntu', 'debian', 'linuxmint', 'pop']:
-            distro_info['package_manager'] = 'apt'
-        elif distro_info['id'] in ['arch', 'manjaro', 'endeavouros']:
-            distro_info['package_manager'] = 'pacman'
-        elif distro_info['id'] in ['fedora', 'centos', 'rhel', 'rocky']:
-            distro_info['package_manager'] = 'dnf'
-        elif distro_info['id'] in ['opensuse', 'suse']:
-            distro_info['package_manager'] = 'zypper'
-        elif distro_info['id'] in ['gentoo']:
-            distro_info['package_manager'] = 'emerge'
-        
-        return distro_info
+        """Определение дистрибутива (из инвентаря, с учетом ID_LIKE)"""
+        return self.inventory.data['distro']
     
     def check_sudo(self):
         """Проверка прав sudo"""
@@ -118,9 +2260,15 @@ class LinuxTweaker:
         self.config = {
             'optimizations': [],
             'installed_packages': [],
+            'unavailable_packages': [],
             'last_run': None,
             'gamemode_enabled': False,
-            'wine_optimized': False
+            'wine_optimized': False,
+            'cpuset': {},
+            'tuning': {},
+            'applied': {},
+            'gamemode': {},
+            'profile': 'gaming'
         }
         
         if os.path.exists(self.config_file):
@@ -169,61 +2317,129 @@ class LinuxTweaker:
         except:
             pass
     
-    def run_command(self, cmd: str, desc: str = "", sudo: bool = False) -> bool:
-        """Выполнение команды"""
+    def log_output(self, stream: str, line: str):
+        """Потоковый вывод команды в терминал и лог"""
+        print(self.color(f"    │ {line}", 'YELLOW' if stream == 'stderr' else 'WHITE'))
+        try:
+            with open(self.log_file, 'a') as f:
+                f.write(f"    {stream}: {line}\n")
+        except:
+            pass
+    
+    def prepare_command(self, cmd, sudo: bool = False, shell: bool = False):
+        """Подготовка команды: argv по умолчанию, sudo при необходимости"""
+        need_sudo = sudo and self.has_sudo and os.geteuid() != 0
+        if shell:
+            if need_sudo:
+                return f"sudo sh -c {shlex.quote(cmd)}"
+            return cmd
+        argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        if need_sudo and argv[:1] != ['sudo']:
+            argv = ['sudo'] + argv
+        return argv
+    
+    def report_result(self, result: Dict, desc: str) -> bool:
+        """Разбор результата команды; полный вывод ошибок сохраняется в файл"""
+        if result['returncode'] == 0 and not result['timed_out']:
+            if desc:
+                self.log(f"Успешно: {desc} ({result['duration']:.1f} с)", "SUCCESS")
+            return True
+        
+        if result['timed_out']:
+            self.log(f"Таймаут: {desc}", "ERROR")
+        else:
+            self.log(f"Ошибка (код {result['returncode']}): {desc}", "ERROR")
+        
+        failed_dir = os.path.join(self.config_dir, "failed")
+        cmd = result['cmd'] if isinstance(result['cmd'], str) else ' '.join(shlex.quote(a) for a in result['cmd'])
+        try:
+            os.makedirs(failed_dir, exist_ok=True)
+            report = os.path.join(failed_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{len(os.listdir(failed_dir))}.log")
+            with open(report, 'w') as f:
+                f.write(f"$ {cmd}\nexit: {result['returncode']}\n\n[stdout]\n")
+                f.write("\n".join(result['stdout']))
+                f.write("\n\n[stderr]\n")
+                f.write("\n".join(result['stderr']))
+            self.log(f"Полный вывод: {report}", "WARNING")
+        except OSError:
+            pass
+        return False
+    
+    def run_command(self, cmd, desc: str = "", sudo: bool = False,
+                    shell: bool = False, timeout: Optional[float] = 300) -> bool:
+        """Выполнение команды (argv без shell, если явно не указано shell=True)"""
         if desc:
             self.log(f"Выполняю: {desc}", "INFO")
         
         try:
-            if sudo and self.has_sudo:
-                cmd = f"sudo {cmd}"
-            
-            result = subprocess.run(cmd, 
-                                  shell=True, 
-                                  capture_output=True, 
-                                  text=True,
-                                  timeout=300)
-            
-            if result.returncode == 0:
-                if desc:
-                    self.log(f"Успешно: {desc}", "SUCCESS")
-                return True
-            else:
-                self.log(f"Ошибка (код {result.returncode}): {desc}", "ERROR")
-                if result.stderr:
-                    self.log(f"Детали: {result.stderr[:200]}", "WARNING")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            self.log(f"Таймаут: {desc}", "ERROR")
-            return False
-        except Exception as e:
+            result = self.executor.run(self.prepare_command(cmd, sudo, shell), shell, timeout)
+        except ValueError as e:
             self.log(f"Исключение: {str(e)}", "ERROR")
             return False
+        return self.report_result(result, desc)
+    
+    def run_commands(self, commands: List, desc: str = "", sudo: bool = False,
+                     shell: bool = False, timeout: Optional[float] = 300) -> bool:
+        """Параллельное выполнение независимых команд"""
+        if desc:
+            self.log(f"Выполняю: {desc}", "INFO")
+        
+        prepared = [self.prepare_command(cmd, sudo, shell) for cmd in commands]
+        results = self.executor.run_many(prepared, shell, timeout)
+        ok = True
+        for result in results:
+            label = result['cmd'] if isinstance(result['cmd'], str) else ' '.join(result['cmd'])
+            ok = self.report_result(result, label[:60]) and ok
+        return ok
+    
+    def run_privileged(self, cmd, desc: str = "") -> bool:
+        """Системная команда через помощника (тот же sudo, что и для записи файлов)"""
+        argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        desc = desc or ' '.join(argv)
+        self.log(f"Выполняю: {desc}", "INFO")
+        try:
+            result = self.helper.call([{'op': 'run_command', 'argv': argv}])[0]
+        except OSError as e:
+            self.log(f"Ошибка ({desc}): {e}", "ERROR")
+            return False
+        if 'returncode' not in result:
+            self.log(f"Ошибка ({desc}): {result.get('error')}", "ERROR")
+            return False
+        result.update(stderr=[], timed_out=False)
+        return self.report_result(result, desc)
     
     def install_packages(self, packages: List[str], desc: str = ""):
         """Установка пакетов в зависимости от дистрибутива"""
         if not packages:
             return True
         
+        ok = self.package_transaction('install', packages, desc)
+        if ok:
+            # Новые файлы в /usr/bin меняют mtime каталога и сбрасывают кэш инвентаря
+            self.inventory.load()
+        return ok
+    
+    def package_transaction(self, action: str, packages: List[str], desc: str = "") -> bool:
+        """Транзакция менеджера пакетов через помощника"""
         pm = self.distro['package_manager']
-        install_cmd = ""
-        
-        if pm == 'apt':
-            install_cmd = f"apt-get install -y {' '.join(packages)}"
-        elif pm == 'pacman':
-            install_cmd = f"pacman -S --noconfirm {' '.join(packages)}"
-        elif pm == 'dnf':
-            install_cmd = f"dnf install -y {' '.join(packages)}"
-        elif pm == 'zypper':
-            install_cmd = f"zypper install -y {' '.join(packages)}"
-        elif pm == 'emerge':
-            install_cmd = f"emerge -av {' '.join(packages)}"
-        else:
+        if pm not in PrivilegedHelper.PACKAGE_COMMANDS:
             self.log(f"Неизвестный менеджер пакетов: {pm}", "ERROR")
             return False
         
-        return self.run_command(install_cmd, desc, sudo=True)
+        if desc:
+            self.log(f"Выполняю: {desc}", "INFO")
+        try:
+            result = self.helper.call([{'op': 'package_transaction', 'manager': pm,
+                                        'action': action, 'packages': packages}])[0]
+        except OSError as e:
+            self.log(f"Ошибка транзакции пакетов: {e}", "ERROR")
+            return False
+        if 'returncode' not in result:
+            self.log(f"Ошибка транзакции пакетов: {result.get('error')}", "ERROR")
+            return False
+        
+        result.update(stderr=[], timed_out=False)
+        return self.report_result(result, desc)
     
     def create_backup(self, file_path: str) -> bool:
         """Создание резервной копии файла"""
@@ -242,6 +2458,130 @@ class LinuxTweaker:
             self.log(f"Ошибка создания бэкапа: {e}", "ERROR")
             return False
     
+    @staticmethod
+    def write_op(path: str, content: str) -> Dict:
+        """Операция помощника для записи: sysfs пишется напрямую, файлы - атомарно"""
+        if path.startswith(PrivilegedHelper.SYSFS_PREFIXES):
+            return {'op': 'write_sysfs', 'path': path, 'value': content}
+        return {'op': 'write_file', 'path': path, 'content': content}
+    
+    def privileged_call(self, ops: List[Dict]):
+        """Пачка операций через помощника; первая ошибка превращается в OSError"""
+        for op, result in zip(ops, self.helper.call(ops)):
+            if not result.get('ok'):
+                target = op.get('path') or op.get('key') or op.get('op')
+                raise OSError(f"{target}: {result.get('error', 'ошибка')}")
+    
+    def privileged_write(self, path: str, content: str):
+        """Запись системного файла или атрибута sysfs через помощника"""
+        self.privileged_call([self.write_op(path, content)])
+    
+    def privileged_command(self, argv: List[str]):
+        """Системная команда через помощника; ошибка или ненулевой код превращаются в OSError"""
+        self.privileged_call([{'op': 'run_command', 'argv': argv}])
+    
+    def privileged_remove(self, path: str):
+        """Удаление системного файла через помощника"""
+        self.privileged_call([{'op': 'remove_file', 'path': path}])
+    
+    def privileged_mkdir(self, path: str):
+        """Создание системного каталога через помощника"""
+        self.privileged_call([{'op': 'make_dir', 'path': path}])
+    
+    def privileged_rmdir(self, path: str):
+        """Удаление пустого системного каталога через помощника"""
+        self.privileged_call([{'op': 'remove_dir', 'path': path}])
+    
+    def user_call(self, ops: List[Dict]):
+        """Те же операции для файлов пользователя: без помощника и без root"""
+        for op in ops:
+            with TRACER.span(op['op'], 'file', path=op['path']) as span:
+                if op['op'] == 'remove_file':
+                    if os.path.exists(op['path']):
+                        os.remove(op['path'])
+                else:
+                    write_text(op['path'], op['content'])
+                    span['bytes'] = len(op['content'].encode())
+    
+    @traced
+    def apply_tuning(self, name: str, plan: Dict) -> bool:
+        """Применение плана тюнинга (sysfs, drop-in файлы, команды) с записью отката"""
+        state = self.config['tuning'].get(name, {'sysfs': {}, 'files': []})
+        
+        for cmd in plan.get('pre_commands', []):
+            self.run_privileged(cmd)
+        
+        ops = []
+        for path, value in plan.get('sysfs', {}).items():
+            # Сохраняем исходное значение только при первом применении
+            if path not in state['sysfs']:
+                state['sysfs'][path] = plan.get('sysfs_revert', {}).get(path, read_sysfs_value(path))
+            ops.append(self.write_op(path, value))
+        
+        originals = state.setdefault('originals', {})
+        for path, content in plan.get('files', {}).items():
+            if os.path.exists(path) and path not in state['files'] and path not in originals:
+                self.create_backup(path)
+                # Чужой файл (grub, записи загрузчика) при откате возвращаем, а не удаляем;
+                # без сохраненного оригинала откат удалил бы его, поэтому не применяем ничего
+                try:
+                    with open(path, 'r') as f:
+                        originals[path] = f.read()
+                except OSError as e:
+                    self.log(f"Ошибка применения ({name}): не удалось сохранить {path}: {e}", "ERROR")
+                    return False
+            ops.append(self.write_op(path, content))
+            if path not in state['files'] and path not in originals:
+                state['files'].append(path)
+        
+        user = state['user'] = plan.get('user', False)
+        try:
+            (self.user_call if user else self.privileged_call)(ops)
+        except OSError as e:
+            self.log(f"Ошибка применения ({name}): {e}", "ERROR")
+            return False
+        finally:
+            state['revert_commands'] = plan.get('revert_commands', [])
+            self.config['tuning'][name] = state
+            self.save_config()
+        
+        ok = True
+        for cmd in plan.get('commands', []):
+            ok = (self.run_command(cmd, cmd) if user else self.run_privileged(cmd)) and ok
+        if not ok:
+            self.log(f"Файлы записаны, но не все команды выполнились ({name})", "WARNING")
+        return ok
+    
+    @traced
+    def revert_tuning(self, name: str) -> bool:
+        """Откат ранее примененного плана тюнинга"""
+        state = self.config['tuning'].get(name)
+        if not state:
+            self.log(f"Нечего откатывать: {name}", "WARNING")
+            return False
+        
+        ops = [{'op': 'remove_file', 'path': path} for path in state.get('files', [])]
+        ops += [self.write_op(path, content) for path, content in state.get('originals', {}).items()]
+        # Обратный порядок: зависимые значения (профиль amdgpu, min/max частоты) раньше базовых
+        ops += [self.write_op(path, value) for path, value in reversed(list(state.get('sysfs', {}).items()))
+                if value is not None and os.path.exists(path)]
+        user = state.get('user', False)
+        try:
+            (self.user_call if user else self.privileged_call)(ops)
+        except OSError as e:
+            self.log(f"Ошибка отката ({name}): {e}", "ERROR")
+            return False
+        
+        ok = True
+        for cmd in state.get('revert_commands', []):
+            ok = (self.run_command(cmd, cmd) if user else self.run_privileged(cmd)) and ok
+        if not ok:
+            self.log(f"Файлы возвращены, но не все команды выполнились ({name})", "WARNING")
+        
+        del self.config['tuning'][name]
+        self.save_config()
+        return True
+    
     # ========== ОСНОВНЫЕ ФУНКЦИИ ОПТИМИЗАЦИИ ==========
     
     def full_optimization(self):
@@ -250,32 +2590,31 @@ class LinuxTweaker:
         print(self.color("🚀 ПОЛНАЯ ОПТИМИЗАЦИЯ LINUX", "YELLOW"))
         print(self.color("=" * 64, "BLUE"))
         
-        print(self.color("Будет выполнено:", "WHITE"))
-        print("  1. 📦 Установка игровых пакетов и утилит")
-        print("  2. 🎮 Настройка GameMode и игровых оптимизаций")
-        print("  3. ⚡ Оптимизация системных параметров")
-        print("  4. 🖥️  Настройка графического стека")
-        print("  5. 🧹 Очистка системы и обслуживание")
-        print("  6. 🔧 Дополнительные настройки")
+        with TRACER.span('plan', 'step'):
+            runnable, skipped = self.plan_steps(self.optimization_tweaks())
+            engine = TweakEngine(self.config['applied'])
+            plan = engine.plan(runnable)
+        
+        print(self.color("План:", "WHITE"))
+        for tweak, action in plan:
+            sign, color, note = TweakEngine.ACTIONS[action]
+            print(self.color(f"  {sign} {tweak.title}", color) + f" ({note})")
+        for title, reason in skipped:
+            print(self.color(f"  - {title}", "RED") + f" (пропуск: {reason})")
+        
+        changes = sum(1 for _, action in plan if action != 'noop')
+        print(self.color(f"\nК применению: {changes}, без изменений: {len(plan) - changes}", "CYAN"))
+        
+        if not changes:
+            self.log("Система уже оптимизирована, изменений нет", "SUCCESS")
+            input(self.color("\nНажмите Enter для возврата в меню...", "CYAN"))
+            return
         
         print(self.color("\n⚠️  Для некоторых действий требуются права sudo", "RED"))
         
         input(self.color("\nНажмите Enter для продолжения или Ctrl+C для отмены...", "CYAN"))
         
-        optimizations = [
-            (self.install_gaming_packages, "Установка игровых пакетов"),
-            (self.setup_gamemode, "Настройка GameMode"),
-            (self.optimize_sysctl, "Оптимизация системных параметров"),
-            (self.optimize_filesystem, "Оптимизация файловой системы"),
-            (self.setup_wine_proton, "Настройка Wine/Proton"),
-            (self.clean_system, "Очистка системы"),
-            (self.optimize_desktop, "Оптимизация рабочего стола")
-        ]
-        
-        for func, name in optimizations:
-            print(self.color(f"\n▶ {name}...", "BLUE"))
-            func()
-            time.sleep(1)
+        engine.apply(plan, on_step=lambda tweak: print(self.color(f"\n▶ {tweak.title}...", "BLUE")))
         
         print(self.color("\n✅ Оптимизация завершена!", "GREEN"))
         print(self.color("💡 Советы:", "YELLOW"))
@@ -291,10 +2630,92 @@ class LinuxTweaker:
         
         input(self.color("\nНажмите Enter для возврата в меню...", "CYAN"))
     
-    def install_gaming_packages(self):
-        """Установка игровых пакетов"""
-        self.log("Установка игровых пакетов...", "INSTALL")
+    def read_files(self, paths: List[str]) -> Dict[str, Optional[str]]:
+        """Текущее содержимое файлов (для проверки состояния)"""
+        return {path: read_text(path) for path in paths}
+    
+    def read_sysctls(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        """Текущие значения sysctl из /proc/sys"""
+        return {key: read_text('/proc/sys/' + key.replace('.', '/')) for key in keys}
+    
+    def optimization_tweaks(self) -> List[Tweak]:
+        """Настройки полной оптимизации с целевыми состояниями и проверками"""
+        packages = [p for p in self.gaming_packages() if p not in self.config.get('unavailable_packages', [])]
+        gamemode_files = self.gamemode_files()
+        gamemode_command = self.gamemode_command()
+        sysctls = dict(parse_sysctl_conf(self.sysctl_optimizations()))
+        fs_type = self.root_fs_type()
+        fs_sysctls = dict(parse_sysctl_conf(self.WRITEBACK_SYSCTL))
+        wine_path, wine_content = self.wine_config()
+        wineprefix = os.path.join(self.home_dir, ".wine_wextweaks")
+        memory_plan = MemoryTuner().plan()
+        memory_desired = {'sysfs': memory_plan['sysfs'], 'files': memory_plan['files']}
+        
+        return [
+            Tweak('packages', "Установка игровых пакетов", packages, self.install_gaming_packages,
+                  probe=lambda: self.installed_packages(packages),
+                  provides=['gamemoded', 'gamemoderun', 'mangohud', 'wine', 'winetricks']),
+            Tweak('gamemode', "Настройка GameMode",
+                  {'installed': True, 'files': gamemode_files, 'hooks': gamemode_command is not None},
+                  self.setup_gamemode,
+                  probe=lambda: {'installed': self.inventory.has('gamemoded'),
+                                 'files': self.read_files(list(gamemode_files)),
+                                 'hooks': self.gamemode_hooks_ready(gamemode_command)},
+                  provides=['gamemoded', 'gamemoderun']),
+            Tweak('sysctl', "Оптимизация системных параметров", {'values': sysctls, 'persisted': True},
+                  self.optimize_sysctl,
+                  probe=lambda: {'values': self.read_sysctls(list(sysctls)),
+                                 'persisted': self.sysctl_persisted()}),
+            Tweak('memory', "Настройка памяти и свопа", memory_desired, self.tune_memory,
+                  probe=lambda: {'sysfs': {p: read_sysfs_value(p) for p in memory_plan['sysfs']},
+                                 'files': self.read_files(list(memory_plan['files']))},
+                  requires=['systemctl']),
+            Tweak('filesystem', "Оптимизация файловой системы", {'fs': fs_type, 'values': fs_sysctls},
+                  self.optimize_filesystem,
+                  probe=lambda: {'fs': fs_type, 'values': self.read_sysctls(list(fs_sysctls))}),
+            Tweak('wine', "Настройка Wine/Proton", {'config': wine_content, 'prefix': True}, self.setup_wine_proton,
+                  probe=lambda: {'config': read_text(wine_path), 'prefix': os.path.isdir(wineprefix)},
+                  requires=['wine', 'winetricks']),
+            # Очистка - обслуживание, а не состояние: не чаще раза в неделю
+            Tweak('clean', "Очистка системы", {'week': time.strftime('%G-%V')}, self.clean_system),
+            Tweak('desktop', "Оптимизация рабочего стола", {'desktop': self.inventory.desktop()},
+                  self.optimize_desktop, requires=self.desktop_requirements(),
+                  skip_reason=None if self.inventory.desktop() else "рабочий стол не распознан"),
+        ]
+    
+    def desktop_requirements(self) -> List[str]:
+        """Утилиты, нужные для оптимизации текущего рабочего стола"""
+        desktop = self.inventory.desktop()
+        if desktop == 'gnome':
+            return ['gsettings']
+        if desktop == 'kde':
+            return ['kwriteconfig6' if self.inventory.has('kwriteconfig6') else 'kwriteconfig5']
+        if desktop == 'xfce':
+            return ['xfconf-query']
+        return []
+    
+    def plan_steps(self, tweaks: List[Tweak]) -> Tuple[List[Tweak], List[Tuple[str, str]]]:
+        """Отсев шагов, которые не могут выполниться, до начала работы"""
+        available = set(self.inventory.data.get('tools', {}))
+        # Без менеджера пакетов установочные шаги ничего не добавят
+        can_install = self.distro['package_manager'] != 'unknown'
         
+        runnable, skipped = [], []
+        for tweak in tweaks:
+            if tweak.skip_reason:
+                skipped.append((tweak.title, tweak.skip_reason))
+                continue
+            missing = [tool for tool in tweak.requires if tool not in available]
+            if missing:
+                skipped.append((tweak.title, "нет: " + ", ".join(missing)))
+                continue
+            if can_install:
+                available.update(tweak.provides)
+            runnable.append(tweak)
+        return runnable, skipped
+    
+    def gaming_packages(self) -> List[str]:
+        """Список игровых пакетов для текущего дистрибутива"""
         # Базовые пакеты для всех дистрибутивов
         common_packages = [
             'gamemode', 'mangohud', 'vkbasalt', 'goverlay',
@@ -321,14 +2742,30 @@ class LinuxTweaker:
         }
         
         # Выбираем пакеты для нашего дистрибутива
-        packages_to_install = common_packages.copy()
+        packages = common_packages.copy()
         if self.distro['package_manager'] in distro_packages:
-            packages_to_install.extend(distro_packages[self.distro['package_manager']])
+            packages.extend(distro_packages[self.distro['package_manager']])
+        return packages
+    
+    @traced
+    def install_gaming_packages(self):
+        """Установка игровых пакетов"""
+        self.log("Установка игровых пакетов...", "INSTALL")
         
-        # Фильтруем уже установленные пакеты
-        installed = self.config.get('installed_packages', [])
-        packages_to_install = [pkg for pkg in packages_to_install if pkg not in installed]
+        # Фильтруем уже установленные пакеты и имена, которых нет в репозиториях дистрибутива
+        unavailable = self.config.get('unavailable_packages', [])
+        packages = [pkg for pkg in self.gaming_packages() if pkg not in unavailable]
+        installed = self.installed_packages(packages)
+        missing = [pkg for pkg in packages if pkg not in installed]
+        available = self.available_packages(missing)
+        unknown = [pkg for pkg in missing if pkg not in available]
+        if unknown:
+            # Иначе транзакция падала бы целиком и шаг никогда не становился бы no-op
+            self.log(f"Нет в репозиториях, пропускаю: {', '.join(unknown)}", "WARNING")
+            self.config['unavailable_packages'] = sorted(set(unavailable) | set(unknown))
+            self.save_config()
         
+        packages_to_install = [pkg for pkg in missing if pkg in available]
         if packages_to_install:
             success = self.install_packages(packages_to_install, "Игровые пакеты")
             if success:
@@ -337,53 +2774,101 @@ class LinuxTweaker:
         else:
             self.log("Все игровые пакеты уже установлены", "SUCCESS")
     
+    def package_query(self, argv: List[str]) -> str:
+        """Вывод запроса к базе пакетов (код возврата не важен: отсутствующие пакеты дают ошибку)"""
+        try:
+            return subprocess.run(argv, capture_output=True, text=True, timeout=60).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            return ''
+    
+    def installed_packages(self, packages: List[str]) -> List[str]:
+        """Пакеты из списка, реально установленные в системе"""
+        if not packages:
+            return []
+        pm = self.distro['package_manager']
+        names = set()
+        if pm == 'apt':
+            output = self.package_query(['dpkg-query', '-W', '-f',
+                                         '${Package} ${Architecture} ${db:Status-Status}\n'] + packages)
+            for line in output.splitlines():
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == 'installed':
+                    names.update([fields[0], f"{fields[0]}:{fields[1]}"])
+        elif pm == 'pacman':
+            names = {line.split()[0] for line in self.package_query(['pacman', '-Q'] + packages).splitlines()
+                     if line.strip()}
+        elif pm in ('dnf', 'zypper'):
+            names = {line.strip() for line in
+                     self.package_query(['rpm', '-q', '--qf', '%{NAME}\n'] + packages).splitlines()}
+        else:
+            # Для emerge запроса нет: верим записи об установке
+            names = set(self.config.get('installed_packages', []))
+        return [pkg for pkg in packages if pkg in names]
+    
+    def available_packages(self, packages: List[str]) -> List[str]:
+        """Пакеты из списка, которые есть в репозиториях дистрибутива"""
+        if not packages:
+            return []
+        pm = self.distro['package_manager']
+        names = set()
+        if pm == 'apt':
+            # Неизвестные имена apt-cache policy не выводит, недоступные - с "Candidate: (none)"
+            name = None
+            for line in self.package_query(['apt-cache', 'policy'] + packages).splitlines():
+                if not line.startswith(' ') and line.endswith(':'):
+                    name = line[:-1]
+                elif name and line.strip().startswith('Candidate:') and '(none)' not in line:
+                    names.add(name)
+        elif pm == 'pacman':
+            for line in self.package_query(['pacman', '-Si'] + packages).splitlines():
+                if line.startswith('Name'):
+                    names.add(line.split(':', 1)[1].strip())
+        elif pm == 'dnf':
+            names = {line.strip() for line in
+                     self.package_query(['dnf', 'repoquery', '-q', '--qf', '%{name}'] + packages).splitlines()}
+        else:
+            names = set(packages)
+        # apt-cache policy пишет родную архитектуру без суффикса :amd64
+        return [pkg for pkg in packages if pkg in names or pkg.split(':')[0] in names]
+    
+    GAMEMODE_SUDOERS = '/etc/sudoers.d/wextweaks-gamemode'
+    GAMEMODE_SCRIPT = '/usr/local/libexec/wextweaks/WexTweaker.py'
+    SYSTEM_PYTHON = '/usr/bin/python3'
+    
+    @traced
     def setup_gamemode(self):
         """Настройка GameMode"""
         self.log("Настройка GameMode...", "INFO")
         
         # Проверяем установлен ли gamemode
-        if not self.run_command("which gamemoded", "Проверка GameMode"):
+        if not self.inventory.has('gamemoded'):
             self.install_packages(['gamemode'], "Установка GameMode")
         
-        # Создаем конфигурацию gamemode
-        gamemode_conf = """[general]
-# Задержка перед запуском (мс)
-start_delay=0
-
-# Управление renice (приоритет процессов)
-renice=10
-
-# Применять к потомкам
-apply_gamescope_to_children=0
-
-# Отключить screensaver
-desktop_phosphor_disable=0
-inhibit_screensaver=1
-
-# Настройки процессора
-cpu governor=performance
-
-# Настройки GPU
-gpu_frequency=maximum
-
-# Настройки ввода
-softrealtime=auto
-
-[filter]
-# Приложения для которых включать gamemode
-whitelist=steam
-whitelist=lutris
-whitelist=wine
-whitelist=proton
-"""
+        # Хукам start/end нужен root без пароля, но только для двух фиксированных команд
+        command = self.gamemode_command()
+        if command is None:
+            self.log(f"Хуки gamemode отключены: {self.SYSTEM_PYTHON} не принадлежит root или доступен на запись", "WARNING")
+            hooks = False
+        else:
+            hooks = self.install_gamemode_hooks(command)
         
-        # Записываем конфигурацию
-        gamemode_dir = os.path.join(self.home_dir, ".config", "gamemode.ini")
+        # Сливаем с конфигом пользователя; исходный файл запоминаем для отката
+        path = self.gamemode_ini_path()
+        current = read_text(path, '') or ''
+        _, unknown, conflicts = merge_gamemode_ini(current, self.gamemode_managed(hooks))
+        for key in unknown:
+            self.log(f"gamemode.ini: ключ {key} не поддерживается gamemode", "WARNING")
+        for conflict in conflicts:
+            self.log(f"gamemode.ini: оставлено значение пользователя {conflict}", "WARNING")
+        if not self.config['gamemode']:
+            legacy = any(key in GAMEMODE_LEGACY_KEYS for _, key, _ in parse_gamemode_ini(current))
+            self.config['gamemode'] = {'original': None if legacy or not os.path.exists(path) else current}
+            if os.path.exists(path):
+                self.create_backup(path)
         try:
-            with open(gamemode_dir, 'w') as f:
-                f.write(gamemode_conf)
-            self.log("Конфигурация GameMode создана", "SUCCESS")
-        except Exception as e:
+            write_text(path, self.gamemode_config(hooks))
+            self.log("Конфигурация GameMode обновлена", "SUCCESS")
+        except OSError as e:
             self.log(f"Ошибка создания конфига: {e}", "ERROR")
         
         # Оптимизация для конкретных игр
@@ -392,10 +2877,92 @@ whitelist=proton
         self.config['gamemode_enabled'] = True
         self.save_config()
     
-    def setup_game_optimizations(self):
-        """Настройка оптимизаций для конкретных игр"""
+    def gamemode_ini_path(self) -> str:
+        """Пользовательский gamemode.ini"""
+        return os.path.join(self.home_dir, ".config", "gamemode.ini")
+    
+    def gamemode_command(self) -> Optional[str]:
+        """Команда хуков от root: системный python в режиме -I и скрипт, который может править только root"""
+        # Иначе пользователь подменил бы интерпретатор, venv, .pth или модуль рядом со скриптом
+        if not root_owned_chain(self.SYSTEM_PYTHON):
+            return None
+        script = os.path.abspath(__file__)
+        if not root_owned_chain(script):
+            script = self.GAMEMODE_SCRIPT
+        return f"{self.SYSTEM_PYTHON} -I {script}"
+    
+    def gamemode_managed(self, hooks: bool) -> Dict[str, Dict]:
+        """Наши ключи gamemode.ini; хуки [custom] - только при установленном правиле sudo"""
+        managed = {
+            'general': {
+                'desiredgov': PROFILES['gaming']['governor'],
+                'softrealtime': 'auto',
+                'renice': 10,
+                'ioprio': 0,
+                'inhibit_screensaver': 1,
+                'disable_splitlock': 1,
+            },
+        }
+        command = self.gamemode_command() if hooks else None
+        if command:
+            managed['custom'] = {
+                'start': [f"sudo -n {command} --game-start"],
+                'end': [f"sudo -n {command} --game-end"],
+                'script_timeout': 10,
+            }
+        return managed
+    
+    def gamemode_config(self, hooks: bool) -> str:
+        """Содержимое gamemode.ini: конфиг пользователя + наши ключи по схеме"""
+        return merge_gamemode_ini(read_text(self.gamemode_ini_path(), '') or '', self.gamemode_managed(hooks))[0]
+    
+    def gamemode_script_content(self) -> str:
+        """Текст этого скрипта (для копии в GAMEMODE_SCRIPT)"""
+        with open(os.path.abspath(__file__)) as f:
+            return f.read()
+    
+    def install_gamemode_hooks(self, command: str) -> bool:
+        """Правило sudo для хуков (и копия скрипта от root, если нужна); True, если visudo его принял"""
+        sudoers = (f"# WexTweaks: хуки gamemode\n"
+                   f"{self.username} ALL=(root) NOPASSWD: {command} --game-start, {command} --game-end\n")
+        try:
+            if command.endswith(' ' + self.GAMEMODE_SCRIPT):
+                self.privileged_call([{'op': 'write_file', 'path': self.GAMEMODE_SCRIPT,
+                                       'content': self.gamemode_script_content(), 'mode': 0o755}])
+                if not root_owned_chain(self.GAMEMODE_SCRIPT):
+                    self.log(f"Хуки gamemode отключены: каталоги над {self.GAMEMODE_SCRIPT} доступны на запись", "WARNING")
+                    self.privileged_remove(self.GAMEMODE_SCRIPT)
+                    return False
+            self.privileged_call([{'op': 'write_file', 'path': self.GAMEMODE_SUDOERS,
+                                   'content': sudoers, 'mode': 0o440}])
+            if not self.run_privileged(['visudo', '-cf', self.GAMEMODE_SUDOERS], "Проверка sudoers"):
+                self.privileged_remove(self.GAMEMODE_SUDOERS)
+                return False
+        except OSError as e:
+            self.log(f"Ошибка записи правила sudo: {e}", "ERROR")
+            return False
+        return True
+    
+    def gamemode_hooks_ready(self, command: Optional[str]) -> bool:
+        """Правило sudo пропускает хуки без пароля, а копия скрипта (если она используется) актуальна"""
+        if command is None:
+            return False
+        if command.endswith(' ' + self.GAMEMODE_SCRIPT):
+            if read_text(self.GAMEMODE_SCRIPT) != self.gamemode_script_content().strip():
+                return False
+        if os.geteuid() == 0:
+            return os.path.exists(self.GAMEMODE_SUDOERS)
+        # /etc/sudoers.d часто закрыт для чтения (0750), поэтому спрашиваем сам sudo
+        try:
+            result = subprocess.run(['sudo', '-n', '-l'] + shlex.split(command) + ['--game-start'],
+                                    capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return result.returncode == 0
+    
+    def game_scripts(self) -> Dict[str, str]:
+        """Скрипты оптимизаций для конкретных игр: путь -> содержимое"""
         optimizations_dir = os.path.join(self.home_dir, ".config", "wextweaks", "game_optimizations")
-        os.makedirs(optimizations_dir, exist_ok=True)
         
         # Настройки для CS:GO
         csgo_conf = """#!/bin/bash
@@ -416,34 +2983,40 @@ export __GL_SYNC_TO_VBLANK=0
 export MESA_LOADER_DRIVER_OVERRIDE=radeonsi
 """
         
+        return {
+            os.path.join(optimizations_dir, "csgo.sh"): csgo_conf,
+            os.path.join(optimizations_dir, "dota2.sh"): dota_conf,
+        }
+    
+    def gamemode_files(self) -> Dict[str, str]:
+        """Все файлы, которые пишет настройка GameMode"""
+        files = {self.gamemode_ini_path(): self.gamemode_config(self.gamemode_command() is not None)}
+        files.update(self.game_scripts())
+        return files
+    
+    def setup_game_optimizations(self):
+        """Настройка оптимизаций для конкретных игр"""
         try:
-            with open(os.path.join(optimizations_dir, "csgo.sh"), 'w') as f:
-                f.write(csgo_conf)
-            os.chmod(os.path.join(optimizations_dir, "csgo.sh"), 0o755)
-            
-            with open(os.path.join(optimizations_dir, "dota2.sh"), 'w') as f:
-                f.write(dota_conf)
-            os.chmod(os.path.join(optimizations_dir, "dota2.sh"), 0o755)
+            for path, content in self.game_scripts().items():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(content)
+                os.chmod(path, 0o755)
             
             self.log("Оптимизации для игр созданы", "SUCCESS")
         except Exception as e:
             self.log(f"Ошибка создания оптимизаций: {e}", "ERROR")
     
-    def optimize_sysctl(self):
-        """Оптимизация sysctl параметров"""
-        self.log("Оптимизация sysctl...", "INFO")
-        
-        # Создаем бэкап текущего sysctl.conf
-        if os.path.exists('/etc/sysctl.conf'):
-            self.create_backup('/etc/sysctl.conf')
-        
-        sysctl_optimizations = """# WexTweaks оптимизации для игр и производительности
+    def sysctl_persisted(self) -> bool:
+        """В /etc/sysctl.conf ровно актуальный блок WexTweaks, без старых"""
+        current = read_text('/etc/sysctl.conf', '')
+        return self.sysctl_conf_content(current).strip() == current
+    
+    def sysctl_optimizations(self) -> str:
+        """Блок оптимизаций для /etc/sysctl.conf"""
+        return """# WexTweaks оптимизации для игр и производительности
 
-# Увеличение буферов TCP/IP
-net.core.rmem_max = 134217728
-net.core.wmem_max = 134217728
-net.ipv4.tcp_rmem = 4096 87380 134217728
-net.ipv4.tcp_wmem = 4096 65536 134217728
+# Буферы TCP, qdisc и контроль перегрузки настраивает tune_network
 
 # Отключение медленного старта TCP
 net.ipv4.tcp_slow_start_after_idle = 0
@@ -457,23 +3030,13 @@ net.core.somaxconn = 65535
 # Увеличение размера очереди принятых пакетов
 net.core.netdev_max_backlog = 5000
 
-# Оптимизация для низкой задержки
-net.ipv4.tcp_low_latency = 1
-net.ipv4.tcp_timestamps = 0
-net.ipv4.tcp_sack = 0
-
 # Увеличение лимитов файловых дескрипторов
 fs.file-max = 2097152
 fs.nr_open = 2097152
 
-# Оптимизация памяти и свопа
-vm.swappiness = 10
+# Оптимизация памяти (swappiness, THP и своп настраивает tune_memory;
+# dirty_*_ratio не задаем - их обнуляют dirty_*_bytes ниже)
 vm.vfs_cache_pressure = 50
-vm.dirty_ratio = 10
-vm.dirty_background_ratio = 5
-
-# Включение Transparent Huge Pages для производительности
-vm.nr_hugepages = 8
 
 # Увеличение размера сегментов shared memory
 kernel.shmmax = 68719476736
@@ -486,62 +3049,130 @@ vm.dirty_writeback_centisecs = 1500
 vm.dirty_background_bytes = 16777216
 vm.dirty_bytes = 50331648
 """
+    
+    # Блок optimize_sysctl любой версии: старые содержали tcp_sack = 0, tcp_timestamps = 0, буферы по 128 МБ,
+    # vm.nr_hugepages = 8 и vm.swappiness = 10
+    SYSCTL_BLOCK = re.compile(r'# WexTweaks оптимизации для игр и производительности\n.*?\nvm\.dirty_bytes = 50331648\n?',
+                              re.S)
+    # Значения ядра по умолчанию для ключей старого блока: без файла они остались бы до перезагрузки
+    LEGACY_SYSCTL_RESET = {'net.ipv4.tcp_sack': '1', 'net.ipv4.tcp_timestamps': '1'}
+    
+    def sysctl_conf_content(self, current: str) -> str:
+        """sysctl.conf с одним актуальным блоком WexTweaks на месте первого найденного"""
+        block = self.sysctl_optimizations()
+        found = []
+        
+        def replace(match):
+            found.append(match.group(0))
+            return block if len(found) == 1 else ''
+        
+        text = self.SYSCTL_BLOCK.sub(replace, current)
+        if not found:
+            text = (current + "\n" if current else "") + block
+        return text
+    
+    def legacy_sysctl_resets(self, text: str) -> List[Dict]:
+        """Операции сброса значений старых блоков WexTweaks, найденных в тексте"""
+        block = self.sysctl_optimizations().strip()
+        if all(found.strip() == block for found in self.SYSCTL_BLOCK.findall(text)):
+            return []
+        resets = dict(self.LEGACY_SYSCTL_RESET)
+        # Статические huge pages и swappiness старого блока возвращаем, только если их не меняли после нас
+        if read_text('/proc/sys/vm/nr_hugepages') == '8':
+            resets['vm.nr_hugepages'] = '0'
+        if read_text('/proc/sys/vm/swappiness') == '10':
+            memory = dict(parse_sysctl_conf(read_text('/' + MemoryTuner.SYSCTL_DROPIN, '') or ''))
+            resets['vm.swappiness'] = memory.get('vm.swappiness', '60')
+        return [{'op': 'set_sysctl', 'key': key, 'value': value} for key, value in resets.items()]
+    
+    @traced
+    def optimize_sysctl(self):
+        """Оптимизация sysctl параметров"""
+        self.log("Оптимизация sysctl...", "INFO")
+        
+        # Создаем бэкап текущего sysctl.conf
+        if os.path.exists('/etc/sysctl.conf'):
+            self.create_backup('/etc/sysctl.conf')
         
-        # Записываем оптимизации во временный файл
-        temp_file = '/tmp/wextweaks_sysctl.conf'
+        sysctl_optimizations = self.sysctl_optimizations()
+        
+        # Старые блоки заменяем актуальным (иначе их значения перекрывают новые) и применяем ключи пачкой
+        current = read_text('/etc/sysctl.conf', '')
+        content = self.sysctl_conf_content(current)
+        ops = []
+        if content.strip() != current:
+            ops.append(self.write_op('/etc/sysctl.conf', content))
+        legacy = self.legacy_sysctl_resets(current)
+        if legacy:
+            self.log("Удален старый блок WexTweaks из /etc/sysctl.conf", "INFO")
+        ops += legacy
+        ops += [{'op': 'set_sysctl', 'key': key, 'value': value}
+                for key, value in parse_sysctl_conf(sysctl_optimizations)]
         try:
-            with open(temp_file, 'w') as f:
-                f.write(sysctl_optimizations)
-            
-            # Применяем изменения
-            self.run_command(f"cat {temp_file} | sudo tee -a /etc/sysctl.conf", "Добавление оптимизаций sysctl", sudo=True)
-            self.run_command("sudo sysctl -p", "Применение sysctl настроек", sudo=True)
+            self.privileged_call(ops)
             self.log("Sysctl оптимизирован", "SUCCESS")
-        except Exception as e:
+        except OSError as e:
             self.log(f"Ошибка оптимизации sysctl: {e}", "ERROR")
     
+    WRITEBACK_SYSCTL = "vm.dirty_writeback_centisecs = 1500\nvm.dirty_expire_centisecs = 3000\n"
+    
+    def root_fs_type(self) -> str:
+        """Тип файловой системы корня из /proc/self/mounts"""
+        fs_type = "ext4"  # По умолчанию
+        for line in (read_text('/proc/self/mounts', '') or '').splitlines():
+            fields = line.split()
+            if len(fields) > 2 and fields[1] == '/':
+                fs_type = fields[2]
+        return fs_type
+    
+    @traced
     def optimize_filesystem(self):
         """Оптимизация файловой системы"""
         self.log("Оптимизация файловой системы...", "INFO")
         
         # Определяем файловую систему
-        fs_type = "ext4"  # По умолчанию
-        try:
-            result = subprocess.run("findmnt -n -o FSTYPE /", shell=True, capture_output=True, text=True)
-            fs_type = result.stdout.strip()
-        except:
-            pass
+        fs_type = self.root_fs_type()
         
         optimizations = []
+        ops = []
         
         if fs_type in ['ext4', 'ext3', 'ext2']:
             # Оптимизации для ext4
-            optimizations.append("sudo tune2fs -O dir_index /dev/root 2>/dev/null")
-            optimizations.append("sudo tune2fs -O has_journal /dev/root 2>/dev/null")
+            optimizations.append(['tune2fs', '-O', 'dir_index', '/dev/root'])
+            optimizations.append(['tune2fs', '-O', 'has_journal', '/dev/root'])
             # Отключаем atime для увеличения производительности
-            optimizations.append("sudo sed -i 's/relatime/noatime,g' /etc/fstab")
+            fstab = read_text('/etc/fstab', '')
+            if 'relatime' in fstab:
+                self.create_backup('/etc/fstab')
+                ops.append(self.write_op('/etc/fstab', fstab.replace('relatime', 'noatime') + "\n"))
             
         elif fs_type in ['btrfs']:
             # Оптимизации для btrfs
-            optimizations.append("sudo btrfs filesystem defrag -r / 2>/dev/null")
+            optimizations.append(['btrfs', 'filesystem', 'defrag', '-r', '/'])
             
         elif fs_type in ['xfs']:
             # Оптимизации для xfs
-            optimizations.append("sudo xfs_fsr / 2>/dev/null")
+            optimizations.append(['xfs_fsr', '/'])
         
         # Общие оптимизации
         # Включаем writeback для SSD
-        optimizations.append("echo 'vm.dirty_writeback_centisecs = 1500' | sudo tee -a /etc/sysctl.conf")
-        optimizations.append("echo 'vm.dirty_expire_centisecs = 3000' | sudo tee -a /etc/sysctl.conf")
+        writeback = self.WRITEBACK_SYSCTL
+        sysctl_conf = read_text('/etc/sysctl.conf', '')
+        if writeback.strip() not in sysctl_conf:
+            ops.append(self.write_op('/etc/sysctl.conf', (sysctl_conf + "\n" if sysctl_conf else "") + writeback))
+        ops += [{'op': 'set_sysctl', 'key': key, 'value': value} for key, value in parse_sysctl_conf(writeback)]
         
         for cmd in optimizations:
-            self.run_command(cmd, f"Оптимизация {fs_type}", sudo=True)
-    
-    def setup_wine_proton(self):
-        """Настройка Wine и Proton"""
-        self.log("Настройка Wine/Proton...", "INFO")
+            self.run_privileged(cmd, f"Оптимизация {fs_type}")
         
-        # Создаем wineprefix для игр
+        try:
+            self.privileged_call(ops)
+            self.log("Настройки fstab и writeback записаны", "SUCCESS")
+        except OSError as e:
+            self.log(f"Ошибка записи настроек ФС: {e}", "ERROR")
+    
+    def wine_config(self) -> Tuple[str, str]:
+        """Путь и содержимое скрипта настроек Wine"""
         wineprefix = os.path.join(self.home_dir, ".wine_wextweaks")
         
         # Настройки для Wine
@@ -572,8 +3203,18 @@ export WINE_CPU_TOPOLOGY=auto
 export PULSE_LATENCY_MSEC=30
 """
         
+        return os.path.join(self.config_dir, "wine_optimizations.sh"), wine_optimizations
+    
+    @traced
+    def setup_wine_proton(self):
+        """Настройка Wine и Proton"""
+        self.log("Настройка Wine/Proton...", "INFO")
+        
+        # Создаем wineprefix для игр
+        wineprefix = os.path.join(self.home_dir, ".wine_wextweaks")
+        
         # Записываем настройки
-        wine_config = os.path.join(self.config_dir, "wine_optimizations.sh")
+        wine_config, wine_optimizations = self.wine_config()
         try:
             with open(wine_config, 'w') as f:
                 f.write(wine_optimizations)
@@ -581,10 +3222,12 @@ export PULSE_LATENCY_MSEC=30
             
             # Создаем wineprefix если не существует
             if not os.path.exists(wineprefix):
-                self.run_command(f"source {wine_config} && wine wineboot", "Создание wineprefix")
+                self.run_command(f". {shlex.quote(wine_config)} && wine wineboot", "Создание wineprefix", shell=True)
             
             # Устанавливаем шрифты и библиотеки
-            self.run_command(f"WINEPREFIX={wineprefix} winetricks corefonts vcrun2019 vcrun2015", "Установка компонентов Wine")
+            if self.inventory.has('winetricks'):
+                self.run_command(['env', f'WINEPREFIX={wineprefix}', 'winetricks', '-q', 'corefonts', 'vcrun2019', 'vcrun2015'],
+                                 "Установка компонентов Wine", timeout=1800)
             
             self.config['wine_optimized'] = True
             self.save_config()
@@ -592,72 +3235,65 @@ export PULSE_LATENCY_MSEC=30
         except Exception as e:
             self.log(f"Ошибка настройки Wine: {e}", "ERROR")
     
+    @traced
     def clean_system(self):
         """Очистка системы"""
         self.log("Очистка системы...", "INFO")
         
-        clean_commands = []
-        
-        # Команды очистки в зависимости от менеджера пакетов
-        if self.distro['package_manager'] == 'apt':
-            clean_commands = [
-                "sudo apt-get autoremove -y",
-                "sudo apt-get autoclean -y",
-                "sudo apt-get clean -y",
-                "sudo rm -rf /var/cache/apt/archives/*",
-                "sudo journalctl --vacuum-time=7d"
-            ]
-        elif self.distro['package_manager'] == 'pacman':
-            clean_commands = [
-                "sudo pacman -Sc --noconfirm",
-                "sudo pacman -Rns $(pacman -Qtdq) --noconfirm 2>/dev/null || true",
-                "sudo rm -f /var/cache/pacman/pkg/*"
-            ]
-        elif self.distro['package_manager'] == 'dnf':
-            clean_commands = [
-                "sudo dnf autoremove -y",
-                "sudo dnf clean all",
-                "sudo rm -rf /var/cache/dnf/*"
-            ]
+        # Сироты и кэш пакетов через помощника (по очереди: общий lock)
+        pm = self.distro['package_manager']
+        actions = PrivilegedHelper.PACKAGE_COMMANDS.get(pm, {})
+        if 'autoremove' in actions:
+            orphans = []
+            if pm == 'pacman':
+                # pacman удаляет сирот только по списку имен
+                result = subprocess.run(['pacman', '-Qtdq'], capture_output=True, text=True)
+                orphans = result.stdout.split()
+            if orphans or pm != 'pacman':
+                self.package_transaction('autoremove', orphans, "Удаление ненужных пакетов")
+        if 'clean' in actions:
+            self.package_transaction('clean', [], "Очистка кэша пакетов")
         
-        # Общие команды очистки
-        clean_commands.extend([
+        # Независимые команды очистки выполняем параллельно
+        self.run_commands([
             # Очистка кэша временных файлов
             f"rm -rf {self.home_dir}/.cache/*",
             f"rm -rf {self.home_dir}/.thumbnails/*",
-            f"rm -rf /tmp/* 2>/dev/null || true",
             
             # Очистка кэша приложений
             f"rm -rf {self.home_dir}/.local/share/Trash/*",
-            
+        ], "Очистка кэшей пользователя", shell=True)
+        
+        for argv in [
             # Очистка старых логов
-            "sudo find /var/log -type f -name '*.log' -mtime +30 -delete",
-            "sudo find /var/log -type f -name '*.gz' -delete",
+            ['find', '/var/log', '-type', 'f', '-name', '*.log', '-mtime', '+30', '-delete'],
+            ['find', '/var/log', '-type', 'f', '-name', '*.gz', '-delete'],
+            ['journalctl', '--vacuum-time=7d'],
             
-            # Очистка кэша systemd
-            "sudo systemd-tmpfiles --clean"
-        ])
-        
-        for cmd in clean_commands:
-            self.run_command(cmd, "Очистка системы", sudo='sudo' in cmd)
+            # Очистка кэша systemd; /tmp чистится им же по возрасту файлов,
+            # а не удалением чужих сокетов и systemd-private-* каталогов
+            ['systemd-tmpfiles', '--clean'],
+        ]:
+            self.run_privileged(argv)
         
         self.log("Система очищена", "SUCCESS")
     
+    @traced
     def optimize_desktop(self):
         """Оптимизация рабочего стола"""
         self.log("Оптимизация рабочего стола...", "INFO")
         
         # Определяем окружение рабочего стола
-        desktop_env = os.environ.get('XDG_CURRENT_DESKTOP', '').lower()
+        desktop_env = self.inventory.desktop()
         
-        if 'gnome' in desktop_env or 'ubuntu' in desktop_env:
+        if desktop_env == 'gnome':
             self.optimize_gnome()
-        elif 'kde' in desktop_env or 'plasma' in desktop_env:
+        elif desktop_env == 'kde':
             self.optimize_kde()
-        elif 'xfce' in desktop_env:
+        elif desktop_env == 'xfce':
             self.optimize_xfce()
         else:
-            self.log(f"Неизвестное окружение: {desktop_env}", "WARNING")
+            self.log(f"Неизвестное окружение: {self.inventory.data['desktop']['name']}", "WARNING")
     
     def optimize_gnome(self):
         """Оптимизация GNOME"""
@@ -687,28 +3323,31 @@ export PULSE_LATENCY_MSEC=30
             "gsettings set org.gnome.mutter experimental-features '[\"kms-modifiers\"]'",
         ]
         
-        for cmd in gnome_commands:
-            self.run_command(cmd, f"Настройка GNOME: {cmd[:50]}...")
+        self.run_commands(gnome_commands, "Настройка GNOME")
     
     def optimize_kde(self):
         """Оптимизация KDE Plasma"""
         self.log("Оптимизация KDE Plasma...", "INFO")
         
+        # Plasma 6 поставляет kwriteconfig6/qdbus6 вместо версий с суффиксом 5
+        kwriteconfig = 'kwriteconfig6' if self.inventory.has('kwriteconfig6') else 'kwriteconfig5'
+        qdbus = 'qdbus6' if self.inventory.has('qdbus6') else 'qdbus'
+        
         kde_commands = [
             # Отключение эффектов рабочего стола
-            "kwriteconfig5 --file kwinrc --group Compositing --key Enabled false",
+            f"{kwriteconfig} --file kwinrc --group Compositing --key Enabled false",
             
             # Отключение анимаций
-            "kwriteconfig5 --file kwinrc --group Plugins --key blurEnabled false",
-            "kwriteconfig5 --file kwinrc --group Plugins --key slideEnabled false",
+            f"{kwriteconfig} --file kwinrc --group Plugins --key blurEnabled false",
+            f"{kwriteconfig} --file kwinrc --group Plugins --key slideEnabled false",
             
             # Оптимизация для игр
-            "kwriteconfig5 --file kwinrc --group Compositing --key GLCore true",
-            "kwriteconfig5 --file kwinrc --group Compositing --key OpenGLIsUnsafe false",
-            
-            # Перезагрузка KWin для применения настроек
-            "qdbus org.kde.KWin /KWin reconfigure"
+            f"{kwriteconfig} --file kwinrc --group Compositing --key GLCore true",
+            f"{kwriteconfig} --file kwinrc --group Compositing --key OpenGLIsUnsafe false",
         ]
+        if self.inventory.has(qdbus):
+            # Перезагрузка KWin для применения настроек
+            kde_commands.append(f"{qdbus} org.kde.KWin /KWin reconfigure")
         
         for cmd in kde_commands:
             self.run_command(cmd, f"Настройка KDE: {cmd[:50]}...")
@@ -729,8 +3368,421 @@ export PULSE_LATENCY_MSEC=30
             "xfconf-query -c xfwm4 -p /general/box_resize -s false",
         ]
         
-        for cmd in xfce_commands:
-            self.run_command(cmd, f"Настройка Xfce: {cmd[:50]}...")
+        self.run_commands(xfce_commands, "Настройка Xfce")
+    
+    def tune_cpu_topology(self):
+        """Разбиение CPU по топологии кэша через cpuset"""
+        self.log("Анализ топологии CPU...", "INFO")
+        
+        topology = CpuTopology()
+        proposal = topology.propose_split()
+        
+        for domain in topology.llc_domains():
+            print(self.color(f"  L{domain['level']} ({domain['size_kb'] // 1024} МБ):", "CYAN") +
+                  f" CPU {format_cpu_list(domain['cpus'])}")
+        for kind, cpus in topology.core_types().items():
+            print(self.color(f"  {kind}:", "CYAN") + f" CPU {format_cpu_list(cpus)}")
+        
+        self.log(proposal['reason'], "INFO")
+        if not proposal['background']:
+            return
+        
+        print(self.color("Игровые ядра:", "GREEN") + f" {format_cpu_list(proposal['game'])}")
+        print(self.color("Фоновые ядра:", "YELLOW") + f" {format_cpu_list(proposal['background'])}")
+        
+        partitioner = CpusetPartitioner(writer=self.privileged_write, mkdir=self.privileged_mkdir,
+                                        runner=self.privileged_command)
+        if not partitioner.available():
+            self.log("cgroup v2 с контроллером cpuset недоступен", "ERROR")
+            return
+        
+        try:
+            previous = partitioner.apply(proposal['game'], proposal['background'])
+        except OSError as e:
+            self.log(f"Ошибка применения cpuset: {e}", "ERROR")
+            return
+        
+        # Сохраняем самые первые значения, чтобы повторный запуск не затер откат
+        if not self.config['cpuset'].get('previous'):
+            self.config['cpuset']['previous'] = previous
+        self.config['cpuset']['game'] = format_cpu_list(proposal['game'])
+        self.config['cpuset']['background'] = format_cpu_list(proposal['background'])
+        self.save_config()
+        self.log("Cpuset применен: службы ограничены фоновыми ядрами", "SUCCESS")
+        launcher = f"{sys.executable} {os.path.abspath(__file__)} --run-game"
+        print(self.color("Игры запускайте через лаунчер:", "YELLOW") + f" {launcher} <команда>")
+        print(self.color("Steam (параметры запуска):", "YELLOW") + f" {launcher} %command%")
+    
+    def revert_cpu_topology(self):
+        """Откат разбиения CPU"""
+        if not self.config['cpuset']:
+            self.log("Разбиение CPU не применялось", "WARNING")
+            return
+        
+        try:
+            CpusetPartitioner(writer=self.privileged_write, rmdir=self.privileged_rmdir,
+                              runner=self.privileged_command).revert(
+                self.config['cpuset'].get('previous', {}))
+        except OSError as e:
+            self.log(f"Ошибка отката cpuset: {e}", "ERROR")
+            return
+        
+        self.config['cpuset'] = {}
+        self.save_config()
+        self.log("Разбиение CPU отменено", "SUCCESS")
+    
+    def tune_memory(self):
+        """Настройка zram/zswap, THP, MGLRU и swappiness"""
+        self.log("Настройка подсистемы памяти...", "INFO")
+        
+        tuner = MemoryTuner()
+        plan = tuner.plan()
+        
+        print(self.color("RAM:", "CYAN") + f" {tuner.total_ram_mb()} МБ")
+        print(self.color("Бэкенд свопа:", "CYAN") + f" {plan['backend']}")
+        if plan['backend'] == 'zram':
+            print(self.color("Размер zram:", "CYAN") + f" {plan['zram_size_mb']} МБ")
+        for path, value in plan['sysfs'].items():
+            print(self.color(f"  {path}:", "CYAN") + f" {read_sysfs_value(path)} → {value}")
+        
+        if plan['backend'] == 'zram' and not os.path.exists('/usr/lib/systemd/system-generators/zram-generator'):
+            package = 'systemd-zram-generator' if self.distro['package_manager'] == 'apt' else 'zram-generator'
+            self.install_packages([package], "Установка zram-generator")
+        
+        if self.apply_tuning('memory', plan):
+            self.log("Подсистема памяти настроена", "SUCCESS")
+    
+    def revert_memory(self):
+        """Откат настроек памяти"""
+        if self.revert_tuning('memory'):
+            self.log("Настройки памяти отменены", "SUCCESS")
+    
+    def print_probe(self, title: str, probe: Dict):
+        """Вывод результатов замера сети"""
+        print(self.color(f"{title}:", "CYAN") +
+              f" p50 {probe['p50_us']:.0f} мкс, p99 {probe['p99_us']:.0f} мкс,"
+              f" {probe['throughput_mbps']:.0f} Мбит/с")
+    
+    def measure_network(self, congestion: Optional[str] = None, runs: int = 3) -> Dict:
+        """Медиана нескольких замеров loopback (один замер слишком шумный)"""
+        probes = [tcp_loopback_probe(congestion=congestion) for _ in range(runs)]
+        return {key: sorted(p[key] for p in probes)[runs // 2] for key in probes[0]}
+    
+    def tune_network(self):
+        """Настройка qdisc, BBR и буферов TCP с проверкой замером"""
+        self.log("Настройка сетевого стека...", "INFO")
+        
+        tuner = NetworkTuner()
+        plan = tuner.plan()
+        print(self.color("Скорость линка:", "CYAN") + f" {plan['speed_mbps']} Мбит/с")
+        print(self.color("Контроль перегрузки:", "CYAN") + f" {plan['congestion']}")
+        print(self.color("Qdisc по умолчанию:", "CYAN") + f" {plan['qdisc']}")
+        print(self.color("Буфер TCP:", "CYAN") + f" {plan['buffer'] // (1024 * 1024)} МБ")
+        
+        # Исходные значения до любых проб - они и пойдут в откат
+        originals = {path: read_sysfs_value(path) for path in plan['sysfs']}
+        for cmd in plan['pre_commands']:
+            self.run_privileged(cmd)
+        
+        try:
+            baseline = self.measure_network()
+        except OSError as e:
+            self.log(f"Замер до изменений не удался: {e}", "ERROR")
+            return
+        self.print_probe("До", baseline)
+        first = baseline
+        
+        # Каждую группу ключей включаем и проверяем отдельно, ухудшившие - возвращаем
+        rejected = []
+        for group, keys in NetworkTuner.GROUPS.items():
+            values = {tuner.sysctl_path(key): plan['sysfs'][tuner.sysctl_path(key)]
+                      for key in keys if tuner.sysctl_path(key) in plan['sysfs']}
+            if not values:
+                continue
+            previous = {path: read_sysfs_value(path) for path in values}
+            try:
+                self.privileged_call([self.write_op(path, value) for path, value in values.items()])
+                probe = self.measure_network()
+            except OSError as e:
+                self.log(f"Проверка группы «{group}» не удалась: {e}", "ERROR")
+                probe = None
+            if probe:
+                self.print_probe(group, probe)
+            if probe is None or probe['p99_us'] > baseline['p99_us'] * 1.2 or \
+                    probe['throughput_mbps'] < baseline['throughput_mbps'] * 0.8:
+                self.log(f"Группа «{group}» не применена: замер показал ухудшение", "WARNING")
+                try:
+                    self.privileged_call([self.write_op(path, value) for path, value in previous.items()
+                                          if value is not None])
+                except OSError as e:
+                    self.log(f"Ошибка возврата группы «{group}»: {e}", "ERROR")
+                rejected += keys
+            else:
+                baseline = probe
+        
+        self.log("Qdisc на loopback не измерить (lo без очереди, default_qdisc - только для новых "
+                 "интерфейсов); эффект BBR на потерях и реальном RTT loopback тоже не показывает", "INFO")
+        final = tuner.plan(skip=rejected)
+        final['sysfs_revert'] = originals
+        if not self.apply_tuning('network', final):
+            return
+        
+        self.config['tuning']['network']['probe'] = {'before': first, 'after': baseline, 'rejected': rejected}
+        self.save_config()
+        self.log("Сетевой стек настроен (qdisc применится к новым интерфейсам и после перезагрузки)", "SUCCESS")
+    
+    def revert_network(self):
+        """Откат сетевых настроек"""
+        if self.revert_tuning('network'):
+            self.log("Сетевые настройки отменены", "SUCCESS")
+    
+    def select_profile(self):
+        """Выбор профиля тюнинга"""
+        names = list(PROFILES)
+        for i, name in enumerate(names, 1):
+            mark = " ←" if name == self.config['profile'] else ""
+            print(self.color(f"  [{i}] {PROFILES[name]['title']} ({name}){mark}", "GREEN"))
+        
+        choice = input(self.color("\nПрофиль: ", "YELLOW")).strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(names):
+            self.config['profile'] = names[int(choice) - 1]
+            self.save_config()
+            self.log(f"Выбран профиль: {PROFILES[self.config['profile']]['title']}", "SUCCESS")
+        else:
+            self.log("Профиль не изменен", "WARNING")
+    
+    def compile_boot_profile(self):
+        """Установка профиля как статических артефактов загрузки"""
+        name = self.config['profile']
+        self.log(f"Сборка загрузочного профиля: {PROFILES[name]['title']}", "INFO")
+        
+        compiler = BootProfileCompiler()
+        plan = compiler.plan(name)
+        for path in plan['files']:
+            print(self.color("  +", "GREEN") + f" {path}")
+        
+        if self.apply_tuning('boot', plan):
+            self.log(f"Профиль применяется при загрузке через {BootProfileCompiler.UNIT_NAME}", "SUCCESS")
+    
+    def check_boot_drift(self):
+        """Проверка расхождения установленных артефактов с контрольными суммами"""
+        if 'boot' not in self.config['tuning']:
+            self.log("Загрузочный профиль не установлен", "WARNING")
+            return
+        
+        drift = BootProfileCompiler().check_drift(self.config['profile'])
+        if not drift:
+            self.log("Артефакты загрузки совпадают с контрольными суммами", "SUCCESS")
+            return
+        for path, state in drift.items():
+            self.log(f"{path}: {state}", "WARNING")
+        self.log("Обнаружено расхождение: пересоберите профиль", "WARNING")
+    
+    def revert_boot_profile(self):
+        """Удаление загрузочных артефактов"""
+        if self.revert_tuning('boot'):
+            self.log("Загрузочный профиль удален", "SUCCESS")
+    
+    def analyze_frametimes(self, paths: Optional[List[str]] = None):
+        """Анализ логов MangoHud"""
+        if paths is None:
+            paths = input(self.color("Пути к CSV-логам MangoHud (через пробел): ", "YELLOW")).split()
+        
+        for path in paths:
+            try:
+                log = parse_mangohud_log(os.path.expanduser(path))
+            except (OSError, ValueError) as e:
+                self.log(f"Ошибка чтения лога: {e}", "ERROR")
+                continue
+            stats = frame_stats(log['frametimes'])
+            
+            print(self.color(f"\n📈 {path}", "YELLOW"))
+            if log['info']:
+                print(self.color("Система:", "CYAN") + f" {log['info'].get('cpu', '?')} / {log['info'].get('gpu', '?')}")
+            if not stats['frames']:
+                self.log("В логе нет кадров", "WARNING")
+                continue
+            print(self.color("Кадров:", "CYAN") + f" {stats['frames']} за {stats['duration_s']:.0f} с")
+            for key, title, _ in FRAME_METRICS:
+                value = stats[key]
+                print(self.color(f"  {title}:", "CYAN") + (f" {value:.2f}" if isinstance(value, float) else f" {value}"))
+    
+    def compare_sessions(self, before: Optional[str] = None, after: Optional[str] = None):
+        """Сравнение двух сессий MangoHud (до и после смены профиля)"""
+        if before is None:
+            before = input(self.color("Лог ДО изменений: ", "YELLOW")).strip()
+            after = input(self.color("Лог ПОСЛЕ изменений: ", "YELLOW")).strip()
+        
+        try:
+            stats = [frame_stats(parse_mangohud_log(os.path.expanduser(path))['frametimes'])
+                     for path in (before, after)]
+        except (OSError, ValueError) as e:
+            self.log(f"Ошибка чтения лога: {e}", "ERROR")
+            return
+        if not stats[0]['frames'] or not stats[1]['frames']:
+            self.log("В одном из логов нет кадров", "WARNING")
+            return
+        
+        print(self.color(f"\n{'Метрика':<18}{'До':>10}{'После':>10}{'Δ':>10}", "YELLOW"))
+        for title, a, b, delta, better in compare_frame_stats(*stats):
+            color = 'GREEN' if better else ('WHITE' if a == b else 'RED')
+            print(f"{title:<18}{a:>10.2f}{b:>10.2f}" + self.color(f"{delta:>+9.1f}%", color))
+    
+    def plan_kernel_cmdline(self):
+        """Планирование и запись параметров загрузки ядра"""
+        self.log("Анализ параметров загрузки ядра...", "INFO")
+        
+        planner = KernelCmdlinePlanner()
+        isolated = parse_cpu_list(self.config['cpuset'].get('game', ''))
+        proposed = planner.propose(PROFILES[self.config['profile']], isolated)
+        changes = planner.diff(proposed)
+        
+        print(self.color("Текущая строка:", "CYAN") + f" {read_text('/proc/cmdline', '')}")
+        if not changes:
+            self.log("Параметры загрузки уже соответствуют профилю", "SUCCESS")
+            return
+        for key, old, new in changes:
+            print(self.color(f"  ~ {key}:", "YELLOW") + f" {old} → {new if new is not None else '(флаг)'}")
+        
+        try:
+            plan = planner.plan({key: new for key, _, new in changes})
+        except (OSError, ValueError) as e:
+            self.log(f"Загрузчик не изменен: {e}", "ERROR")
+            return
+        if not plan['files']:
+            self.log("Не найден GRUB или systemd-boot (запустите с sudo, если ESP закрыт для чтения)", "ERROR")
+            return
+        for path in plan['files']:
+            print(self.color("  файл:", "CYAN") + f" {path}")
+        
+        confirm = input(self.color("\nЗаписать изменения загрузчика? (y/n): ", "RED"))
+        if confirm.lower() != 'y':
+            return
+        if self.apply_tuning('cmdline', plan):
+            self.log("Параметры загрузки записаны, нужна перезагрузка", "SUCCESS")
+    
+    def revert_kernel_cmdline(self):
+        """Возврат исходных параметров загрузки"""
+        if self.revert_tuning('cmdline'):
+            self.log("Параметры загрузки восстановлены, нужна перезагрузка", "SUCCESS")
+    
+    def audio_latency_report(self):
+        """Фактическая задержка звука по данным PipeWire"""
+        if not self.inventory.has('pw-metadata'):
+            return None
+        try:
+            result = subprocess.run(['pw-metadata', '-n', 'settings'], capture_output=True,
+                                    text=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return AudioTuner.effective(AudioTuner.parse_metadata(result.stdout))
+    
+    def print_audio_latency(self):
+        """Вывод фактической задержки"""
+        effective = self.audio_latency_report()
+        if effective:
+            print(self.color("Фактически:", "CYAN") +
+                  f" quantum {effective['quantum']} @ {effective['rate']} Гц = {effective['latency_ms']:.1f} мс")
+        else:
+            print(self.color("Фактическая задержка недоступна (нет pw-metadata)", "YELLOW"))
+    
+    def tune_audio(self):
+        """Настройка задержки PipeWire/PulseAudio по профилю"""
+        self.log("Настройка задержки звука...", "INFO")
+        
+        tuner = AudioTuner(self.home_dir)
+        server = tuner.server()
+        if not server:
+            self.log("Звуковой сервер не запущен (PipeWire/PulseAudio)", "ERROR")
+            return
+        settings = PROFILES[self.config['profile']]['audio']
+        try:
+            plan = tuner.plan(settings, server)
+        except ValueError as e:
+            self.log(f"Неверные параметры звука: {e}", "ERROR")
+            return
+        
+        print(self.color("Сервер:", "CYAN") + f" {server}")
+        self.print_audio_latency()
+        print(self.color("Цель:", "CYAN") +
+              f" quantum {settings['quantum']} (мин. {settings['min_quantum']}) @ {settings['rate']} Гц"
+              f" = {AudioTuner.latency_ms(settings['quantum'], settings['rate']):.1f} мс")
+        
+        if self.apply_tuning('audio', plan):
+            self.log("Задержка звука настроена", "SUCCESS")
+            if server == 'pipewire':
+                time.sleep(1)
+                self.print_audio_latency()
+    
+    def revert_audio(self):
+        """Откат настроек звука"""
+        if self.revert_tuning('audio'):
+            self.log("Настройки звука отменены", "SUCCESS")
+    
+    def tune_gpu(self):
+        """Фиксация режима GPU по профилю"""
+        self.log("Настройка режима GPU...", "INFO")
+        
+        plan = GpuTuner().plan(PROFILES[self.config['profile']]['gpu'])
+        for card in plan['skipped']:
+            self.log(f"Пропуск {card}: режим через sysfs не поддерживается", "WARNING")
+        if not plan['sysfs']:
+            self.log("Нет карт amdgpu/i915/xe для настройки", "ERROR")
+            return
+        for path, value in plan['sysfs'].items():
+            print(self.color(f"  {path}:", "CYAN") + f" {read_sysfs_value(path)} → {value}")
+        
+        if self.apply_tuning('gpu', plan):
+            self.log("Режим GPU установлен", "SUCCESS")
+    
+    def revert_gpu(self):
+        """Возврат исходного режима GPU"""
+        if self.revert_tuning('gpu'):
+            self.log("Режим GPU восстановлен", "SUCCESS")
+    
+    def advanced_menu(self):
+        """Меню расширенного тюнинга"""
+        items = [
+            ("1", "🧩 Разбиение CPU по топологии", self.tune_cpu_topology),
+            ("2", "↺ Отменить разбиение CPU", self.revert_cpu_topology),
+            ("3", "🧠 Память: zram/zswap, THP, MGLRU", self.tune_memory),
+            ("4", "↺ Отменить настройки памяти", self.revert_memory),
+            ("5", "🌐 Сеть: qdisc, BBR, буферы", self.tune_network),
+            ("6", "↺ Отменить сетевые настройки", self.revert_network),
+            ("7", "🎚  Выбрать профиль", self.select_profile),
+            ("8", "🥾 Собрать загрузочный профиль", self.compile_boot_profile),
+            ("9", "🔎 Проверить расхождение профиля", self.check_boot_drift),
+            ("10", "↺ Удалить загрузочный профиль", self.revert_boot_profile),
+            ("11", "📈 Анализ логов MangoHud", self.analyze_frametimes),
+            ("12", "⚖  Сравнить две сессии MangoHud", self.compare_sessions),
+            ("13", "🐧 Параметры загрузки ядра", self.plan_kernel_cmdline),
+            ("14", "↺ Вернуть параметры загрузки", self.revert_kernel_cmdline),
+            ("15", "🔊 Задержка звука (PipeWire)", self.tune_audio),
+            ("16", "↺ Откатить настройки звука", self.revert_audio),
+            ("17", "🎮 Режим GPU по профилю", self.tune_gpu),
+            ("18", "↺ Вернуть режим GPU", self.revert_gpu),
+        ]
+        
+        while True:
+            self.print_banner()
+            print(self.color("🧪 РАСШИРЕННЫЙ ТЮНИНГ", "YELLOW") +
+                  self.color(f"  (профиль: {PROFILES[self.config['profile']]['title']})", "CYAN"))
+            print(self.color("=" * 64, "BLUE"))
+            for key, title, _ in items:
+                print(self.color(f"  [{key}] {title}", "GREEN"))
+            print(self.color("  [0] ⬅ Назад", "GREEN"))
+            
+            choice = input(self.color("\nВыберите действие: ", "YELLOW")).strip()
+            if choice == '0':
+                return
+            for key, _, func in items:
+                if choice == key:
+                    func()
+                    input(self.color("\nНажмите Enter...", "CYAN"))
+                    break
+            else:
+                print(self.color("Неверный выбор!", "RED"))
+                time.sleep(1)
     
     def system_info(self):
         """Информация о системе"""
@@ -778,27 +3830,13 @@ export PULSE_LATENCY_MSEC=30
         except:
             pass
         
-        # Информация о GPU
-        try:
-            # Проверяем NVIDIA
-            nvidia_result = subprocess.run("nvidia-smi --query-gpu=name --format=csv,noheader", 
-                                         shell=True, capture_output=True, text=True)
-            if nvidia_result.returncode == 0:
-                print(self.color("Видеокарта:", "CYAN") + f" NVIDIA {nvidia_result.stdout.strip()}")
-            else:
-                # Проверяем AMD
-                amd_result = subprocess.run("lspci | grep -i vga | grep -i amd", 
-                                          shell=True, capture_output=True, text=True)
-                if amd_result.stdout:
-                    print(self.color("Видеокарта:", "CYAN") + f" {amd_result.stdout.strip()}")
-                else:
-                    # Проверяем Intel
-                    intel_result = subprocess.run("lspci | grep -i vga | grep -i intel", 
-                                                shell=True, capture_output=True, text=True)
-                    if intel_result.stdout:
-                        print(self.color("Видеокарта:", "CYAN") + f" {intel_result.stdout.strip()}")
-        except:
-            pass
+        # Информация о GPU (из sysfs через инвентарь)
+        for gpu in self.inventory.data.get('gpus', []):
+            driver = f" ({gpu['driver']})" if gpu['driver'] else ""
+            print(self.color("Видеокарта:", "CYAN") + f" {gpu['card']}: {gpu['vendor'].upper()}{driver}")
+        
+        distro = self.inventory.data['distro']
+        print(self.color("Семейство:", "CYAN") + f" {distro['family']} ({distro['package_manager']})")
         
         # Статус оптимизаций
         print(self.color("\n⚡ СТАТУС ОПТИМИЗАЦИЙ:", "YELLOW"))
@@ -819,6 +3857,7 @@ export PULSE_LATENCY_MSEC=30
         
         input(self.color("\nНажмите Enter для возврата...", "CYAN"))
     
+    @traced
     def create_restore_point(self):
         """Создание точки восстановления"""
         self.log("Создание точки восстановления...", "INFO")
@@ -840,11 +3879,14 @@ export PULSE_LATENCY_MSEC=30
         existing_files = [f for f in files_to_backup if os.path.exists(f)]
         
         if existing_files:
-            cmd = f"sudo tar -czf {backup_file} {' '.join(existing_files)}"
-            if self.run_command(cmd, "Создание бэкапа системы", sudo=True):
+            # Все файлы читаемы без root, поэтому архив собираем без sudo
+            try:
+                with tarfile.open(backup_file, 'w:gz') as tar:
+                    for path in existing_files:
+                        tar.add(path)
                 self.log(f"Точка восстановления создана: {backup_file}", "SUCCESS")
-            else:
-                self.log("Не удалось создать точку восстановления", "ERROR")
+            except (OSError, tarfile.TarError) as e:
+                self.log(f"Не удалось создать точку восстановления: {e}", "ERROR")
         else:
             self.log("Нет файлов для бэкапа", "WARNING")
     
@@ -866,28 +3908,55 @@ export PULSE_LATENCY_MSEC=30
             return
         
         # Восстанавливаем sysctl из бэкапа
-        sysctl_backup = os.path.join(self.backup_dir, "sysctl.conf.backup*")
-        if self.run_command(f"ls {sysctl_backup} 2>/dev/null | head -1", "Поиск бэкапа sysctl"):
-            latest_backup = subprocess.run(f"ls -t {sysctl_backup} | head -1", 
-                                         shell=True, capture_output=True, text=True)
-            if latest_backup.stdout.strip():
-                backup_file = latest_backup.stdout.strip()
-                self.run_command(f"sudo cp {backup_file} /etc/sysctl.conf", "Восстановление sysctl", sudo=True)
-                self.run_command("sudo sysctl -p", "Применение sysctl", sudo=True)
-        
-        # Восстанавливаем конфиг gamemode
-        gamemode_conf = os.path.join(self.home_dir, ".config", "gamemode.ini")
-        if os.path.exists(gamemode_conf):
+        sysctl_backups = sorted(Path(self.backup_dir).glob("sysctl.conf.backup*"),
+                                key=lambda p: p.stat().st_mtime, reverse=True)
+        if sysctl_backups:
+            # Бэкап мог сохранить старый блок WexTweaks: его значения не возвращаем
+            backup = sysctl_backups[0].read_text()
+            try:
+                self.privileged_call([self.write_op('/etc/sysctl.conf', self.SYSCTL_BLOCK.sub('', backup))] +
+                                     self.legacy_sysctl_resets(backup))
+                self.log("Sysctl восстановлен из бэкапа", "SUCCESS")
+            except OSError as e:
+                self.log(f"Ошибка восстановления sysctl: {e}", "ERROR")
+            self.run_privileged(['sysctl', '-p'], "Применение sysctl")
+        
+        # Восстанавливаем конфиг gamemode пользователя (или удаляем созданный нами)
+        gamemode_conf = self.gamemode_ini_path()
+        original = self.config.get('gamemode', {}).get('original')
+        if original is not None:
+            write_text(gamemode_conf, original + "\n")
+            self.log("Конфиг GameMode восстановлен", "SUCCESS")
+        elif os.path.exists(gamemode_conf):
             os.remove(gamemode_conf)
             self.log("Конфиг GameMode удален", "SUCCESS")
+        if self.config.get('gamemode'):
+            try:
+                self.privileged_remove(self.GAMEMODE_SUDOERS)
+                if os.path.exists(self.GAMEMODE_SCRIPT):
+                    self.privileged_remove(self.GAMEMODE_SCRIPT)
+            except OSError as e:
+                self.log(f"Ошибка удаления правила sudo: {e}", "ERROR")
+        
+        # Откатываем разбиение CPU и модули тюнинга
+        if self.config.get('cpuset'):
+            self.revert_cpu_topology()
+        for name in list(self.config.get('tuning', {})):
+            self.revert_tuning(name)
         
         # Сбрасываем настройки
         self.config = {
             'optimizations': [],
             'installed_packages': [],
+            'unavailable_packages': [],
             'last_run': time.strftime('%Y-%m-%d %H:%M:%S'),
             'gamemode_enabled': False,
-            'wine_optimized': False
+            'wine_optimized': False,
+            'cpuset': {},
+            'tuning': {},
+            'applied': {},
+            'gamemode': {},
+            'profile': 'gaming'
         }
         self.save_config()
         
@@ -908,6 +3977,7 @@ export PULSE_LATENCY_MSEC=30
             ("7", "💾 ТОЧКА ВОССТАНОВЛЕНИЯ", "Создать бэкап настроек"),
             ("8", "📊 ИНФОРМАЦИЯ О СИСТЕМЕ", "Проверка состояния"),
             ("9", "↺ ВОССТАНОВИТЬ НАСТРОЙКИ", "Вернуть стандартные настройки"),
+            ("A", "🧪 РАСШИРЕННЫЙ ТЮНИНГ", "Топология CPU, память, сеть, профили"),
             ("0", "🚪 ВЫХОД", "Завершение работы")
         ]
         
@@ -921,10 +3991,29 @@ export PULSE_LATENCY_MSEC=30
         if not self.has_sudo:
             print(self.color("⚠️  Нет прав sudo! Некоторые функции недоступны", "RED"))
         
-        choice = input(self.color("\nВыберите действие (0-9): ", "YELLOW"))
+        choice = input(self.color("\nВыберите действие (0-9, A): ", "YELLOW"))
         
         return choice
     
+    def finish_trace(self):
+        """Сохранение трассировки и сводка по времени"""
+        if not TRACER.enabled or not TRACER.events:
+            return
+        
+        path = TRACER.target or os.path.join(self.config_dir, "traces",
+                                             f"trace_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            TRACER.export(path)
+        except OSError as e:
+            self.log(f"Не удалось сохранить трассировку: {e}", "ERROR")
+        
+        print(self.color("\n⏱  ТРАССИРОВКА", "YELLOW"))
+        print(self.color(f"{'категория':<11}{'имя':<28}{'раз':>5}{'всего, мс':>12}{'макс, мс':>11}{'байт':>9}{'ошиб.':>7}", "CYAN"))
+        for row in TRACER.summary()[:25]:
+            print(f"{row['category']:<11}{row['name'][:27]:<28}{row['count']:>5}{row['total_ms']:>12.1f}"
+                  f"{row['max_ms']:>11.1f}{row['bytes']:>9}{row['failed']:>7}")
+        print(self.color(f"Chrome trace: {path} (chrome://tracing или ui.perfetto.dev)", "WHITE"))
+    
     def run(self):
         """Главный цикл программы"""
         try:
@@ -956,6 +4045,8 @@ export PULSE_LATENCY_MSEC=30
                     self.system_info()
                 elif choice == '9':
                     self.restore_settings()
+                elif choice.lower() == 'a':
+                    self.advanced_menu()
                 elif choice == '0':
                     print(self.color("\nСпасибо за использование WexTweaks Linux! 🐧", "GREEN"))
                     print(self.color("Не забудьте перезагрузиться для применения изменений!", "YELLOW"))
@@ -972,9 +4063,40 @@ export PULSE_LATENCY_MSEC=30
             import traceback
             traceback.print_exc()
             input(self.color("\nНажмите Enter для выхода...", "CYAN"))
+        finally:
+            self.helper.close()
+            self.finish_trace()
 
 def main():
     """Точка входа"""
+    parser = argparse.ArgumentParser(description="WexTweaks Linux Optimizer")
+    # Режим привилегированного помощника (запускается самим WexTweaks через sudo)
+    parser.add_argument('--helper', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--analyze', nargs='+', metavar='CSV', help="анализ логов MangoHud")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="сравнение двух сессий MangoHud")
+    parser.add_argument('--run-game', nargs=argparse.REMAINDER, metavar='CMD',
+                        help="запуск игры на игровых ядрах (после разбиения CPU)")
+    # Хуки [custom] из gamemode.ini (через sudo -n)
+    parser.add_argument('--game-start', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--game-end', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--trace', nargs='?', const='1', metavar='FILE',
+                        help="трассировка шагов в формате Chrome trace (или WEXTWEAKS_TRACE=1)")
+    args = parser.parse_args()
+    
+    if args.trace:
+        TRACER.enable(args.trace)
+    
+    if args.helper:
+        run_helper()
+        return
+    if args.run_game:
+        run_game(args.run_game)
+    if args.game_start or args.game_end:
+        if os.geteuid() != 0:
+            print("Хуки gamemode запускаются через sudo", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(game_profile_start() if args.game_start else game_profile_end())
+    
     # Проверяем, что мы на Linux
     if platform.system() != "Linux":
         print("Эта программа работает только на Linux!")
@@ -985,6 +4107,15 @@ def main():
         print("Требуется Python 3.7 или выше!")
         sys.exit(1)
     
+    if args.analyze or args.compare:
+        app = LinuxTweaker()
+        if args.analyze:
+            app.analyze_frametimes(args.analyze)
+        if args.compare:
+            app.compare_sessions(*args.compare)
+        app.finish_trace()
+        return
+    
     print("Загрузка WexTweaks Linux Optimizer...")
     time.sleep(1)
     
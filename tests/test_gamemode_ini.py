@@ -0,0 +1,66 @@
+"""Тесты слияния gamemode.ini с конфигом пользователя"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from WexTweaker import merge_gamemode_ini  # noqa: E402
+
+HOOK = 'sudo -n /usr/bin/python3 -I /usr/local/libexec/wextweaks/WexTweaker.py'
+MANAGED = {
+    'general': {'desiredgov': 'performance', 'renice': 10},
+    'custom': {'start': [HOOK + ' --game-start'], 'end': [HOOK + ' --game-end']},
+}
+USER = (
+    "; gamemode.ini example\n"
+    "[general]\n"
+    "; The desired governor\n"
+    "desiredgov=powersave\n"
+    "\n"
+    "[custom]\n"
+    "start=notify-send started\n"
+    "start=sudo -n /usr/bin/python3 -I /old/WexTweaker.py --game-start\n"
+    ";end=notify-send ended\n"
+)
+
+
+def test_user_lines_kept_in_place():
+    text, unknown, conflicts = merge_gamemode_ini(USER, MANAGED)
+    assert text == (
+        "; gamemode.ini example\n"
+        "[general]\n"
+        "; The desired governor\n"
+        "desiredgov=powersave\n"
+        "renice=10\n"
+        "\n"
+        "[custom]\n"
+        "start=notify-send started\n"
+        ";end=notify-send ended\n"
+        f"start={HOOK} --game-start\n"
+        f"end={HOOK} --game-end\n"
+    )
+    assert unknown == []
+    assert conflicts == ["[general] desiredgov=powersave (WexTweaks: performance)"]
+
+
+def test_merge_is_stable():
+    text = merge_gamemode_ini(USER, MANAGED)[0]
+    assert merge_gamemode_ini(text, MANAGED)[0] == text
+
+
+def test_hooks_removed_when_not_managed():
+    text = merge_gamemode_ini(USER, MANAGED)[0]
+    assert '--game-' not in merge_gamemode_ini(text, {'general': MANAGED['general']})[0]
+
+
+def test_unknown_keys_reported_but_kept():
+    text, unknown, _ = merge_gamemode_ini("[general]\nfoo=bar\n", {})
+    assert text == "[general]\nfoo=bar\n"
+    assert unknown == ["[general] foo"]
+
+
+def test_legacy_template_replaced():
+    text, unknown, _ = merge_gamemode_ini("[general]\ncpu governor=performance\n", {'general': {'renice': 10}})
+    assert 'cpu governor' not in text and 'renice=10' in text
+    assert unknown == []
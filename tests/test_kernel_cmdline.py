@@ -0,0 +1,130 @@
+"""Тесты KernelCmdlinePlanner на поддельных /etc и /boot"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from WexTweaker import KernelCmdlinePlanner  # noqa: E402
+
+KEY = KernelCmdlinePlanner.GRUB_KEY
+ENTRY = (
+    "title   Arch Linux\n"
+    "linux   /vmlinuz-linux\n"
+    "initrd  /initramfs-linux.img\n"
+    "options root=UUID=1234 rw quiet\n"
+)
+
+
+def make_tree(root, grub=None, entries=None, kernel_cmdline=None):
+    """Поддельное дерево: /etc/default/grub, записи systemd-boot, /etc/kernel/cmdline"""
+    if grub is not None:
+        os.makedirs(os.path.join(root, 'etc', 'default'))
+        with open(os.path.join(root, 'etc', 'default', 'grub'), 'w') as f:
+            f.write(grub)
+    if entries:
+        directory = os.path.join(root, 'boot', 'loader', 'entries')
+        os.makedirs(directory)
+        for name, text in entries.items():
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(text)
+    if kernel_cmdline is not None:
+        os.makedirs(os.path.join(root, 'etc', 'kernel'))
+        with open(os.path.join(root, 'etc', 'kernel', 'cmdline'), 'w') as f:
+            f.write(kernel_cmdline)
+    return KernelCmdlinePlanner(str(root))
+
+
+@pytest.mark.parametrize('line, expected', [
+    (f'{KEY}="quiet splash"', f'{KEY}="quiet splash preempt=full"'),
+    (f'{KEY}="quiet" # c', f'{KEY}="quiet preempt=full" # c'),
+    (f"{KEY}='quiet splash'", f'{KEY}="quiet splash preempt=full"'),
+    (f'{KEY}=quiet', f'{KEY}="quiet preempt=full"'),
+    (f'{KEY}=""', f'{KEY}="preempt=full"'),
+    (f'{KEY}="quiet preempt=none"', f'{KEY}="quiet preempt=full"'),
+    (f'  {KEY}="quiet"  ', f'  {KEY}="quiet preempt=full"  '),
+])
+def test_render_grub_values(line, expected):
+    planner = KernelCmdlinePlanner('/nonexistent')
+    text = f'GRUB_DEFAULT=0\n{line}\nGRUB_TIMEOUT=5\n'
+    assert planner.render_grub(text, {'preempt': 'full'}) == f'GRUB_DEFAULT=0\n{expected}\nGRUB_TIMEOUT=5\n'
+
+
+def test_render_grub_keeps_quoted_parameters():
+    planner = KernelCmdlinePlanner('/nonexistent')
+    text = f'{KEY}="quiet acpi_osi=\\"Windows 2020\\""\n'
+    assert planner.render_grub(text, {'nowatchdog': None}) == \
+        f'{KEY}="quiet acpi_osi=\\"Windows 2020\\" nowatchdog"\n'
+
+
+def test_render_grub_edits_last_assignment():
+    planner = KernelCmdlinePlanner('/nonexistent')
+    text = f'{KEY}="quiet"\n#{KEY}="old"\n{KEY}="splash"\n'
+    assert planner.render_grub(text, {'nowatchdog': None}) == \
+        f'{KEY}="quiet"\n#{KEY}="old"\n{KEY}="splash nowatchdog"\n'
+
+
+def test_render_grub_appends_missing_key():
+    planner = KernelCmdlinePlanner('/nonexistent')
+    assert planner.render_grub('GRUB_TIMEOUT=5\n', {'nowatchdog': None}) == \
+        f'GRUB_TIMEOUT=5\n{KEY}="nowatchdog"\n'
+
+
+@pytest.mark.parametrize('line', [
+    f'{KEY}="$GRUB_CMDLINE_LINUX quiet"',
+    f'{KEY}="quiet',
+    f'{KEY}="quiet"splash',
+    f'{KEY}=`cat /etc/cmdline`',
+    f'{KEY}="quiet"#c',
+])
+def test_render_grub_refuses_unparsed_line(line):
+    planner = KernelCmdlinePlanner('/nonexistent')
+    with pytest.raises(ValueError):
+        planner.render_grub(f'{line}\n', {'preempt': 'full'})
+
+
+def test_render_entry_updates_options_only():
+    planner = KernelCmdlinePlanner('/nonexistent')
+    assert planner.render_entry(ENTRY, {'rw': None, 'preempt': 'full'}) == ENTRY.replace(
+        'options root=UUID=1234 rw quiet', 'options root=UUID=1234 rw quiet preempt=full')
+
+
+def test_render_entry_adds_missing_options():
+    planner = KernelCmdlinePlanner('/nonexistent')
+    text = "title Linux\nlinux /vmlinuz\n"
+    assert planner.render_entry(text, {'nowatchdog': None}) == text + "options nowatchdog\n"
+
+
+def test_plan_covers_all_bootloaders(tmp_path):
+    planner = make_tree(tmp_path, grub=f'{KEY}="quiet" # c\n', entries={'arch.conf': ENTRY},
+                        kernel_cmdline='root=UUID=1234 rw\n')
+    plan = planner.plan({'preempt': 'full'})
+    files = {os.path.relpath(path, tmp_path): content for path, content in plan['files'].items()}
+    assert files == {
+        'etc/default/grub': f'{KEY}="quiet preempt=full" # c\n',
+        'boot/loader/entries/arch.conf': ENTRY.replace('quiet', 'quiet preempt=full'),
+        'etc/kernel/cmdline': 'root=UUID=1234 rw preempt=full\n',
+    }
+    assert len(plan['commands']) == 1
+    assert plan['revert_commands'] == plan['commands']
+
+
+def test_plan_without_bootloader_is_empty(tmp_path):
+    plan = make_tree(tmp_path).plan({'preempt': 'full'})
+    assert plan['files'] == {} and plan['commands'] == []
+
+
+def test_plan_aborts_on_unreadable_entry(tmp_path):
+    planner = make_tree(tmp_path, entries={'arch.conf': ENTRY})
+    # Каталог вместо файла: open() падает одинаково и под root
+    os.makedirs(os.path.join(tmp_path, 'boot', 'loader', 'entries', 'broken.conf'))
+    with pytest.raises(OSError):
+        planner.plan({'preempt': 'full'})
+
+
+def test_plan_aborts_on_unparsed_grub(tmp_path):
+    planner = make_tree(tmp_path, grub=f'{KEY}="$EXTRA quiet"\n', entries={'arch.conf': ENTRY})
+    with pytest.raises(ValueError):
+        planner.plan({'preempt': 'full'})